@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 默认缓存位置：docker-compose 中挂载的 ./data 目录
+DEFAULT_CACHE_PATH = os.path.join(os.getenv("DATA_DIR", "data"), "annotation_cache.sqlite3")
+
+
+class AnnotationCache:
+    """基于SQLite的标注结果缓存
+
+    以 (模型, 温度, 标注要求, 标注选项, 行文本) 的哈希为键，
+    支持按条目数和保存时长淘汰，并统计命中/未命中次数。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 200000,
+                 max_age_days: float = 30, evict_interval: int = 1000):
+        """初始化缓存并清理过期条目"""
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self.evict_interval = evict_interval
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS annotations (
+                key TEXT PRIMARY KEY,
+                label TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON annotations (accessed_at)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(model: str, temperature: float, annotation_requirements: str,
+                 annotation_options: List[str], text: str) -> str:
+        """计算缓存键"""
+        payload = json.dumps(
+            [model, round(float(temperature), 4), annotation_requirements, list(annotation_options), text],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """批量查询缓存，返回命中的 {键: 标注}"""
+        keys = list(keys)
+        found: Dict[str, str] = {}
+        if not keys:
+            return found
+
+        now = time.time()
+        with self._lock:
+            # SQLite 单条语句参数数量有限，分段查询
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, label, created_at FROM annotations WHERE key IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for key, label, created_at in rows:
+                    if now - created_at <= self.max_age_seconds:
+                        found[key] = label
+
+            if found:
+                self._conn.executemany(
+                    "UPDATE annotations SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def set_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        """批量写入缓存"""
+        now = time.time()
+        rows = [(key, label, now, now) for key, label in items]
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO annotations (key, label, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._writes_since_evict += len(rows)
+            should_evict = self._writes_since_evict >= self.evict_interval
+
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """按保存时长和最大条目数淘汰缓存，返回删除的条目数"""
+        with self._lock:
+            cutoff = time.time() - self.max_age_seconds
+            deleted = self._conn.execute(
+                "DELETE FROM annotations WHERE created_at < ?", (cutoff,)
+            ).rowcount
+
+            # 超出容量时删除最久未访问的条目
+            count = self._conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                deleted += self._conn.execute(
+                    """
+                    DELETE FROM annotations WHERE key IN (
+                        SELECT key FROM annotations ORDER BY accessed_at ASC LIMIT ?
+                    )
+                    """,
+                    (overflow,)
+                ).rowcount
+
+            self._conn.commit()
+            self._writes_since_evict = 0
+        return deleted
+
+    def clear(self) -> None:
+        """清空缓存和统计"""
+        with self._lock:
+            self._conn.execute("DELETE FROM annotations")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """返回缓存统计信息"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else None,
+                "entries": entries
+            }
@@ -0,0 +1,785 @@
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import openai
+from openai import OpenAI
+from pydantic import BaseModel
+
+from annotation_cache import AnnotationCache
+from batching import fit_max_tokens, fixed_batch_sizes, plan_batch_sizes
+from capability_registry import CapabilityRegistry
+from client_registry import ClientRegistry
+from job_checkpoint import JobCheckpoint
+from metrics import RunMetrics, error_reason, usage_counts
+from pricing import estimate_cost
+from prompt_formats import (
+    LOGPROB_OPTION_CODES, OUTPUT_COMPACT, OUTPUT_JSON, OUTPUT_LOGPROB, OUTPUT_STRUCTURED,
+    PROMPT_FORMAT_COMPACT, PROMPT_FORMAT_JSON, PROMPT_FORMAT_LOGPROB,
+    build_messages, parse_compact_response, pick_option_by_logprobs
+)
+from rate_limiter import RateLimiter
+from token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class AnnotationCancelled(Exception):
+    """标注任务被取消"""
+
+
+class BatchAnnotationError(Exception):
+    """整批标注失败，reason 为失败原因（如 truncated、parse_error），用于指标和判断是否拆分重试"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+# 只有与响应内容有关的失败才拆分批次重试；鉴权、连接等错误拆分后仍会失败，只会成倍增加请求
+BISECT_FAILURES = {"count_mismatch", "truncated", "parse_error"}
+
+
+def describe_failure(error: Exception) -> Tuple[str, str]:
+    """返回异常对应的 (失败原因, 提示信息)"""
+    if isinstance(error, BatchAnnotationError):
+        return error.reason, str(error)
+    return error_reason(error), f"AI标注出错：{str(error)}"
+
+
+def is_endpoint_error(error: Exception) -> bool:
+    """鉴权失败、无权限、连接失败或超时：同一接口上的其他请求也会失败"""
+    return isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError, openai.APIConnectionError))
+
+
+def is_logprobs_error(error: Exception) -> bool:
+    """接口以400拒绝的是 logprobs / top_logprobs 参数，而不是上下文过长等其他原因"""
+    return isinstance(error, openai.BadRequestError) and "logprobs" in str(error).lower()
+
+
+def is_response_format_error(error: Exception) -> bool:
+    """接口以400/404/422拒绝的是 response_format / json_schema 参数，而不是上下文过长等其他原因"""
+    if not isinstance(error, (openai.BadRequestError, openai.NotFoundError, openai.UnprocessableEntityError)):
+        return False
+    text = str(error).lower()
+    return "response_format" in text or "json_schema" in text
+
+
+# 定义结构化输出模型
+class AnnotationResult(BaseModel):
+    """标注结果的结构化模型"""
+    annotations: List[str]
+    
+class SingleAnnotation(BaseModel):
+    """单个标注的结构化模型"""
+    text: str
+    label: str
+    confidence: Optional[float] = None
+
+
+class AIAnnotator:
+    """AI标注器类"""
+    
+    def __init__(self, api_key: str, base_url: str = None, cache: Optional[AnnotationCache] = None,
+                 capabilities: Optional[CapabilityRegistry] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 message_handler: Optional[Callable[[int, str], None]] = None,
+                 clients: Optional[ClientRegistry] = None,
+                 prompt_format: str = PROMPT_FORMAT_JSON,
+                 metrics: Optional[RunMetrics] = None):
+        """初始化AI标注器
+        
+        message_handler(日志级别, 消息) 用于展示标注过程中的警告和错误，
+        未提供时写入日志，便于在Streamlit之外（如命令行）运行。
+        提供 clients 时从登记表复用客户端及其连接池，否则单独创建客户端。
+        prompt_format 为 "compact" 时使用紧凑格式：数据逐行编号，模型只返回选项编号；
+        为 "logprob" 时逐条请求单个字母并按logprobs取概率最大的选项，置信度记录在 confidences 中；
+        此时不读写结果缓存（缓存的键不含提示词格式，也不保存置信度，命中的数据会没有置信度）。
+        提供 metrics 时记录每次请求的耗时、用量、重试、回退和失败原因。
+        """
+        if not api_key:
+            raise ValueError("需要提供OpenAI API密钥")
+        
+        if clients is not None:
+            self.client = clients.get(api_key, base_url)
+        else:
+            self.client = OpenAI(
+                api_key=api_key,
+                base_url=base_url
+            )
+        # 配置限流器时由限流器负责重试，关闭SDK自带的重试（副本与原客户端共用连接池）
+        if rate_limiter:
+            self.client = self.client.with_options(max_retries=0)
+        self.base_url = str(self.client.base_url)
+        self.cache = cache
+        self.capabilities = capabilities
+        self.rate_limiter = rate_limiter
+        self.message_handler = message_handler
+        self.prompt_format = prompt_format
+        self.metrics = metrics
+        # 接口返回的实际token用量
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # 输入token中命中服务端提示词缓存的部分（按缓存价格计费）
+        self.cached_tokens = 0
+        # 单字母分类模式下每条文本的置信度
+        self.confidences: Dict[str, float] = {}
+        self._usage_lock = threading.Lock()
+    
+    def _notify(self, level: int, message: str):
+        """输出警告或错误信息"""
+        if self.message_handler:
+            self.message_handler(level, message)
+        else:
+            logger.log(level, message)
+    
+    def _record_fallback(self, path: str):
+        if self.metrics:
+            self.metrics.record_fallback(path)
+    
+    def _record_failure(self, reason: str, rows: int):
+        if self.metrics:
+            self.metrics.record_failure(reason, rows)
+    
+    def _fail_batch(self, reason: str, message: str, rows: int) -> List[str]:
+        """把整批数据标注为失败，每条数据在指标中只计一次"""
+        self._notify(logging.ERROR, message)
+        self._record_failure(reason, rows)
+        return ["标注失败"] * rows
+    
+    def _instrument(self, create, model: str):
+        """包装请求函数，记录每次尝试的耗时、用量和失败原因；同一请求再次被调用即为重试"""
+        metrics = self.metrics
+        failures = []
+        
+        def attempt(**params):
+            if failures:
+                metrics.record_retry(failures[-1])
+            started = time.perf_counter()
+            try:
+                response = create(**params)
+            except Exception as e:
+                failures.append(error_reason(e))
+                metrics.record_request(model, time.perf_counter() - started, error=failures[-1])
+                raise
+            metrics.record_request(model, time.perf_counter() - started, *usage_counts(getattr(response, "usage", None)))
+            return response
+        
+        return attempt
+    
+    def _request(self, create, **params):
+        """发送补全请求，配置了限流器时经过限流和重试"""
+        estimated_tokens = sum(estimate_tokens(message["content"]) for message in params.get("messages", []))
+        # 输入加 max_tokens 超过上下文长度的请求会被接口拒绝，按预计输入降低本次的 max_tokens
+        if params.get("max_tokens"):
+            params["max_tokens"] = fit_max_tokens(params.get("model", ""), params["max_tokens"], estimated_tokens)
+        if self.metrics is not None:
+            create = self._instrument(create, params.get("model", ""))
+        if self.rate_limiter is None:
+            response = create(**params)
+        else:
+            response = self.rate_limiter.call(create, estimated_tokens=estimated_tokens, **params)
+        
+        prompt_tokens, completion_tokens, cached_tokens = usage_counts(getattr(response, "usage", None))
+        with self._usage_lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+        return response
+        
+    
+    def test_connection(self) -> tuple[bool, str, list]:
+        """测试API连接并获取可用模型列表"""
+        try:
+            # 测试连接并获取模型列表
+            models_response = self.client.models.list()
+            models = []
+            
+            # 过滤出常用的聊天模型
+            chat_models = []
+            for model in models_response.data:
+                model_id = model.id
+                # 筛选常用的聊天模型
+                if any(keyword in model_id.lower() for keyword in [
+                    'gpt-3.5', 'gpt-4', 'gpt-35', 'claude', 'chat', 'turbo', 'gemini', 'flash'
+                ]):
+                    chat_models.append(model_id)
+                models.append(model_id)
+            
+            # 如果没有找到聊天模型，使用所有模型
+            if not chat_models:
+                chat_models = models
+            
+            # 排序模型列表
+            chat_models.sort()
+            
+            return True, f"连接成功！找到 {len(chat_models)} 个可用的聊天模型", chat_models
+            
+        except Exception as e:
+            return False, f"连接失败: {str(e)}", []
+    
+    def test_annotation(self, model: str = "gpt-3.5-turbo") -> tuple[bool, str, dict]:
+        """测试标注功能"""
+        try:
+            # 多样化的测试数据
+            test_data = [
+                "这个产品很棒，我很满意！拍照效果超出预期。",
+                "价格太贵了，性价比不高，不推荐购买。", 
+                "产品质量还行，有优点也有缺点，总体来说一般般。"
+            ]
+            test_requirements = "判断用户对产品的情感态度"
+            test_options = ["正面", "负面", "中性"]
+            
+            # 重新探测该模型的输出能力
+            if self.capabilities:
+                self.capabilities.forget(self.base_url, model)
+            
+            # 调用标注，使用更大的 max_tokens
+            result = self.annotate_batch(
+                test_data, 
+                test_requirements, 
+                test_options, 
+                model=model,
+                temperature=0.1,
+                max_tokens=1000
+            )
+            
+            if result and len(result) > 0 and result[0] != "标注失败":
+                test_info = {
+                    "test_data": test_data,
+                    "requirements": test_requirements,
+                    "options": test_options,
+                    "results": result
+                }
+                if self.prompt_format == PROMPT_FORMAT_LOGPROB:
+                    logprobs = self.capabilities.supports_logprobs(self.base_url, model) if self.capabilities else None
+                    test_info["output_mode"] = "紧凑格式（模型不支持logprobs）" if logprobs is False else "单字母分类（logprobs）"
+                    test_info["confidences"] = [self.confidences.get(text) for text in test_data]
+                elif self.prompt_format == PROMPT_FORMAT_COMPACT:
+                    test_info["output_mode"] = "紧凑格式（返回选项编号）"
+                elif self.capabilities:
+                    structured = self.capabilities.supports_structured(self.base_url, model)
+                    test_info["output_mode"] = "结构化输出" if structured else "JSON回退模式"
+                return True, "测试成功！", test_info
+            else:
+                return False, "测试失败：未获得有效标注结果", {}
+                
+        except Exception as e:
+            return False, f"测试失败: {str(e)}", {}
+    
+    def annotate_batch(self, data: List[str], annotation_requirements: str, 
+                      annotation_options: List[str], model: str = "gpt-3.5-turbo",
+                      temperature: float = 0.1, max_tokens: int = 2000) -> List[str]:
+        """批量标注数据 - 优先读取缓存，仅将未命中的数据发送给模型（单字母分类模式不使用缓存）"""
+        if self.cache is None or self.prompt_format == PROMPT_FORMAT_LOGPROB:
+            return self._annotate_with_recovery(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
+        
+        keys = [
+            AnnotationCache.make_key(model, temperature, annotation_requirements, annotation_options, text)
+            for text in data
+        ]
+        cached = self.cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        
+        annotations = [cached.get(key) for key in keys]
+        if missing:
+            fresh = self._annotate_with_recovery(
+                [data[i] for i in missing], annotation_requirements, annotation_options, model, temperature, max_tokens
+            )
+            for i, label in zip(missing, fresh):
+                annotations[i] = label
+            # 失败结果不写入缓存，下次重新请求
+            self.cache.set_many((keys[i], label) for i, label in zip(missing, fresh) if label != "标注失败")
+        
+        return annotations
+    
+    def _annotate_with_recovery(self, data: List[str], annotation_requirements: str, 
+                                annotation_options: List[str], model: str = "gpt-3.5-turbo",
+                                temperature: float = 0.1, max_tokens: int = 2000) -> List[str]:
+        """批量标注数据，因响应内容整批失败时二分拆分重试
+        
+        数量不匹配、响应截断或JSON解析失败时，将批次递归拆成两半分别重试，直到单条数据，
+        只有单条仍失败的数据才标注为失败。鉴权、连接等其他错误与批次内容无关，整批直接标注为失败。
+        """
+        try:
+            return self._annotate_uncached(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
+        except Exception as e:
+            reason, message = describe_failure(e)
+            # 单字母分类本来就逐条请求，拆分没有意义
+            if len(data) <= 1 or reason not in BISECT_FAILURES or self.prompt_format == PROMPT_FORMAT_LOGPROB:
+                return self._fail_batch(reason, message, len(data))
+            self._notify(logging.WARNING, f"{message}，拆分批次重试")
+        
+        self._record_fallback("bisect")
+        middle = len(data) // 2
+        return (
+            self._annotate_with_recovery(data[:middle], annotation_requirements, annotation_options, model, temperature, max_tokens)
+            + self._annotate_with_recovery(data[middle:], annotation_requirements, annotation_options, model, temperature, max_tokens)
+        )
+    
+    def _annotate_uncached(self, data: List[str], annotation_requirements: str, 
+                           annotation_options: List[str], model: str = "gpt-3.5-turbo",
+                           temperature: float = 0.1, max_tokens: int = 2000) -> List[str]:
+        """批量标注数据 - 优先使用结构化输出，失败时抛出 BatchAnnotationError 或接口异常"""
+        if self.prompt_format == PROMPT_FORMAT_LOGPROB:
+            return self.annotate_batch_logprob(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
+        if self.prompt_format == PROMPT_FORMAT_COMPACT:
+            return self.annotate_batch_compact(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
+        
+        # 已知不支持结构化输出的模型直接使用JSON模式
+        if self.capabilities and self.capabilities.supports_structured(self.base_url, model) is False:
+            self._record_fallback("json")
+            return self.annotate_batch_fallback(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
+        
+        # 第一步：尝试结构化输出
+        try:
+            response = self._request(
+                self.client.beta.chat.completions.parse,
+                model=model,
+                messages=build_messages(data, annotation_requirements, annotation_options, OUTPUT_STRUCTURED),
+                response_format=AnnotationResult,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            
+            if response and response.choices and response.choices[0].message.parsed:
+                parsed_result = response.choices[0].message.parsed
+                annotations = parsed_result.annotations
+                if self.capabilities:
+                    self.capabilities.record_structured(self.base_url, model, True)
+                
+                # 验证标注数量
+                if len(annotations) == len(data):
+                    return annotations
+                else:
+                    self._notify(logging.WARNING, "结构化输出标注数量不匹配，回退到普通模式")
+                    
+        except Exception as e:
+            # 鉴权、连接和其他与输出格式无关的接口错误，改用JSON模式同样会失败
+            if is_endpoint_error(e) or (
+                isinstance(e, openai.APIStatusError) and e.status_code not in (400, 404, 422)
+            ):
+                raise
+            # 仅在接口明确拒绝 response_format 参数时记录；上下文过长等其他400错误、
+            # 单次响应解析失败和网络抖动等临时错误不影响登记
+            if self.capabilities and is_response_format_error(e):
+                self.capabilities.record_structured(self.base_url, model, False)
+            self._notify(logging.WARNING, f"结构化输出失败: {str(e)}，回退到普通模式")
+        
+        # 第二步：回退到传统JSON输出
+        self._record_fallback("json")
+        return self.annotate_batch_fallback(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
+    
+    def annotate_batch_compact(self, data: List[str], annotation_requirements: str, 
+                               annotation_options: List[str], model: str = "gpt-3.5-turbo",
+                               temperature: float = 0.1, max_tokens: int = 2000) -> List[str]:
+        """紧凑格式：数据逐行编号输入，模型返回逗号分隔的选项编号，在本地映射回选项文字"""
+        response = self._request(
+            self.client.chat.completions.create,
+            model=model,
+            messages=build_messages(data, annotation_requirements, annotation_options, OUTPUT_COMPACT),
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        
+        if not response or not response.choices or not response.choices[0].message.content:
+            raise BatchAnnotationError("empty_response", "AI返回空响应，请检查API配置")
+        
+        choice = response.choices[0]
+        if choice.finish_reason == 'length':
+            raise BatchAnnotationError("truncated", f"AI响应被截断，请增加最大输出长度。当前设置: {max_tokens}")
+        
+        annotations = parse_compact_response(choice.message.content, len(data), annotation_options)
+        if annotations is None:
+            raise BatchAnnotationError(
+                "parse_error", f"无法解析选项编号，期望 {len(data)} 个编号，实际响应: {choice.message.content[:200]}"
+            )
+        return annotations
+    
+    def classify_row(self, text: str, annotation_requirements: str, annotation_options: List[str],
+                     model: str = "gpt-3.5-turbo", temperature: float = 0.1) -> SingleAnnotation:
+        """单条分类：只请求一个字母token并返回logprobs，取概率最大的选项，置信度为其概率占比"""
+        response = self._request(
+            self.client.chat.completions.create,
+            model=model,
+            messages=build_messages([text], annotation_requirements, annotation_options, OUTPUT_LOGPROB),
+            temperature=temperature,
+            max_tokens=1,
+            logprobs=True,
+            top_logprobs=min(len(LOGPROB_OPTION_CODES), max(5, len(annotation_options)))
+        )
+        
+        choice = response.choices[0] if response and response.choices else None
+        if choice is None:
+            return SingleAnnotation(text=text, label="标注失败")
+        
+        if choice.logprobs and choice.logprobs.content:
+            picked = pick_option_by_logprobs(
+                ((candidate.token, candidate.logprob) for candidate in choice.logprobs.content[0].top_logprobs),
+                annotation_options
+            )
+            if picked:
+                return SingleAnnotation(text=text, label=picked[0], confidence=picked[1])
+        
+        # 接口未返回logprobs时按输出的字母取选项，没有置信度
+        code = (choice.message.content or "").strip().upper()[:1]
+        index = LOGPROB_OPTION_CODES.find(code) if code else -1
+        if 0 <= index < len(annotation_options):
+            return SingleAnnotation(text=text, label=annotation_options[index])
+        return SingleAnnotation(text=text, label="标注失败")
+    
+    def annotate_batch_logprob(self, data: List[str], annotation_requirements: str, 
+                               annotation_options: List[str], model: str = "gpt-3.5-turbo",
+                               temperature: float = 0.1, max_tokens: int = 2000) -> List[str]:
+        """单字母分类模式：逐条调用 classify_row，并记录每条文本的置信度"""
+        if len(annotation_options) > len(LOGPROB_OPTION_CODES):
+            self._notify(logging.WARNING, f"选项超过 {len(LOGPROB_OPTION_CODES)} 个，无法使用单字母分类，改用紧凑格式")
+            self._record_fallback("compact")
+            return self.annotate_batch_compact(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
+        
+        # 已知不支持logprobs的模型直接使用紧凑格式
+        if self.capabilities and self.capabilities.supports_logprobs(self.base_url, model) is False:
+            self._record_fallback("compact")
+            return self.annotate_batch_compact(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
+        
+        annotations = []
+        for i, text in enumerate(data):
+            try:
+                result = self.classify_row(text, annotation_requirements, annotation_options, model, temperature)
+                if result.label == "标注失败":
+                    self._record_failure("invalid_letter", 1)
+            except openai.BadRequestError as e:
+                # 模型不支持logprobs或max_tokens=1，本批剩余数据改用紧凑格式；
+                # 明确拒绝logprobs参数时记入登记表，之后的批次不再发送注定失败的请求
+                if self.capabilities and is_logprobs_error(e):
+                    self.capabilities.record_logprobs(self.base_url, model, False)
+                self._notify(logging.WARNING, f"单字母分类请求失败: {str(e)}，改用紧凑格式")
+                self._record_fallback("compact")
+                try:
+                    return annotations + self.annotate_batch_compact(
+                        data[i:], annotation_requirements, annotation_options, model, temperature, max_tokens
+                    )
+                except Exception as compact_error:
+                    return annotations + self._fail_batch(*describe_failure(compact_error), len(data) - i)
+            except Exception as e:
+                # 鉴权或连接失败时剩余数据也会失败，不再逐条请求
+                if is_endpoint_error(e):
+                    return annotations + self._fail_batch(*describe_failure(e), len(data) - i)
+                self._notify(logging.ERROR, f"AI标注出错：{str(e)}")
+                self._record_failure(error_reason(e), 1)
+                result = SingleAnnotation(text=text, label="标注失败")
+            
+            if result.confidence is not None:
+                with self._usage_lock:
+                    self.confidences[text] = result.confidence
+            annotations.append(result.label)
+        
+        failed = annotations.count("标注失败")
+        if failed:
+            self._notify(logging.WARNING, f"{failed} 条数据未返回有效的选项字母")
+        return annotations
+    
+    def annotate_batch_fallback(self, data: List[str], annotation_requirements: str, 
+                              annotation_options: List[str], model: str = "gpt-3.5-turbo",
+                              temperature: float = 0.1, max_tokens: int = 2000) -> List[str]:
+        """传统JSON输出模式（回退方案）"""
+        # 准备请求参数（包含安全设置）
+        request_params = {
+            "model": model,
+            "messages": build_messages(data, annotation_requirements, annotation_options, OUTPUT_JSON),
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+
+        response = self._request(self.client.chat.completions.create, **request_params)
+        
+        # 检查响应是否为空
+        if not response or not response.choices:
+            raise BatchAnnotationError("empty_response", "AI返回空响应，请检查API配置")
+        
+        # 解析响应
+        choice = response.choices[0]
+        
+        # 检查消息是否存在
+        if not choice.message or not hasattr(choice.message, 'content'):
+            raise BatchAnnotationError("empty_response", "AI响应格式错误，未包含有效内容")
+        
+        result_text = choice.message.content
+        
+        # 检查响应是否被截断
+        if choice.finish_reason == 'length':
+            raise BatchAnnotationError("truncated", f"AI响应被截断，请增加最大输出长度。当前设置: {max_tokens}")
+        
+        if result_text is None or result_text.strip() == "":
+            raise BatchAnnotationError("empty_response", "AI返回空响应内容")
+        
+        result_text = result_text.strip()
+        
+        # 清理响应文本，处理各种可能的格式
+        def clean_json_response(text):
+            text = text.strip()
+            
+            # 处理markdown代码块
+            if text.startswith('```'):
+                lines = text.split('\n')
+                if len(lines) >= 3:
+                    # 去掉第一行和最后一行
+                    text = '\n'.join(lines[1:-1]).strip()
+            
+            # 处理可能的额外文字说明
+            if '{' in text and '}' in text:
+                # 提取JSON部分
+                start = text.find('{')
+                end = text.rfind('}') + 1
+                text = text[start:end]
+            
+            return text.strip()
+        
+        result_text = clean_json_response(result_text)
+        
+        # 尝试解析JSON
+        try:
+            result_json = json.loads(result_text)
+        except json.JSONDecodeError as e:
+            raise BatchAnnotationError(
+                "parse_error", f"AI响应格式错误，无法解析JSON。错误详情: {str(e)}，处理后的响应: {result_text[:200]}..."
+            ) from e
+        annotations = result_json.get("annotations", []) if isinstance(result_json, dict) else []
+        
+        # 验证标注数量
+        if len(annotations) != len(data):
+            raise BatchAnnotationError("count_mismatch", f"标注数量不匹配：期望 {len(data)}，实际 {len(annotations)}")
+        
+        return annotations
+
+
+def iter_batches(data: List[str], batch_sizes: List[int]) -> Iterator[List[str]]:
+    """按每批条数依次切出批次，用到时才切片"""
+    start = 0
+    for size in batch_sizes:
+        yield data[start:start + size]
+        start += size
+
+
+def annotate_concurrently(annotator: AIAnnotator, data: List[str], batch_size: int,
+                          annotation_requirements: str, annotation_options: List[str],
+                          model: str = "gpt-3.5-turbo", temperature: float = 0.1,
+                          max_tokens: int = 2000, max_workers: int = 4,
+                          progress_callback=None,
+                          checkpoint: Optional[JobCheckpoint] = None,
+                          batch_sizes: Optional[List[int]] = None,
+                          cancel_event: Optional[threading.Event] = None) -> List[str]:
+    """并发批量标注，结果按原始行顺序返回
+
+    同时在途的请求数不超过 max_workers；每完成一批就在调用线程中回调
+    progress_callback(已完成行数, 已完成批数)，便于更新进度条。
+    提供 checkpoint 时跳过断点中已完成的批次，并把新完成的批次写入断点。
+    提供 batch_sizes 时按其给出的每批条数切分，否则按固定的 batch_size 切分。
+    cancel_event 被设置后不再发出新的批次，等待在途批次完成后抛出 AnnotationCancelled，
+    已完成的批次仍会写入断点。
+    """
+    if batch_sizes is None:
+        batch_sizes = fixed_batch_sizes(len(data), batch_size)
+    results: List[Optional[List[str]]] = [None] * len(batch_sizes)
+    
+    # 从断点恢复已完成的批次
+    if checkpoint is not None:
+        for index, batch_annotations in checkpoint.load().items():
+            if 0 <= index < len(batch_sizes) and len(batch_annotations) == batch_sizes[index]:
+                results[index] = batch_annotations
+    
+    def run_batch(batch_data: List[str]) -> List[str]:
+        return annotator.annotate_batch(
+            batch_data,
+            annotation_requirements,
+            annotation_options,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+    
+    done_rows = sum(batch_sizes[index] for index, result in enumerate(results) if result is not None)
+    done_batches = sum(1 for result in results if result is not None)
+    if done_batches and progress_callback:
+        progress_callback(done_rows, done_batches)
+    
+    # 按需生成尚未完成的批次
+    remaining = (
+        (index, batch_data)
+        for index, batch_data in enumerate(iter_batches(data, batch_sizes))
+        if results[index] is None
+    )
+    pending = {}
+    exhausted = False
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while not exhausted or pending:
+            # 补足在途请求，滑动窗口控制并发
+            if cancel_event is not None and cancel_event.is_set():
+                exhausted = True
+            while not exhausted and len(pending) < max(1, max_workers):
+                next_batch = next(remaining, None)
+                if next_batch is None:
+                    exhausted = True
+                    break
+                index, batch_data = next_batch
+                pending[executor.submit(run_batch, batch_data)] = index
+            
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = pending.pop(future)
+                try:
+                    batch_annotations = future.result()
+                except Exception:
+                    batch_annotations = ["标注失败"] * batch_sizes[index]
+                results[index] = batch_annotations
+                # 含失败结果的批次不写入断点，恢复时会重新请求
+                if checkpoint is not None and "标注失败" not in batch_annotations:
+                    checkpoint.append(index, batch_annotations)
+                done_rows += batch_sizes[index]
+                done_batches += 1
+                if progress_callback:
+                    progress_callback(done_rows, done_batches)
+    
+    if any(result is None for result in results):
+        raise AnnotationCancelled(f"标注已取消，已完成 {done_batches}/{len(batch_sizes)} 批")
+    
+    all_annotations = []
+    for batch_annotations in results:
+        all_annotations.extend(batch_annotations)
+    return all_annotations
+
+
+def annotate_cascade(annotator: AIAnnotator, escalation_annotator: AIAnnotator, data: List[str],
+                     batch_size: int, annotation_requirements: str, annotation_options: List[str],
+                     model: str, escalation_model: str, confidence_threshold: float = 0.8,
+                     temperature: float = 0.1, max_tokens: int = 2000, max_workers: int = 4,
+                     progress_callback=None, checkpoint: Optional[JobCheckpoint] = None,
+                     cancel_event: Optional[threading.Event] = None,
+                     batch_sizes: Optional[List[int]] = None,
+                     adaptive_batching: bool = True) -> Tuple[List[str], List[Optional[float]], Dict]:
+    """模型级联标注：先用便宜的模型标注，只把低置信度或无效的结果交给更强的模型重新标注
+
+    annotator 应使用单字母分类格式，才能得到每条数据的置信度（该格式不使用结果缓存）；
+    escalation_annotator 使用任意格式。progress_callback(阶段, 已完成行数, 总行数, 已完成批数, 总批数) 在调用线程中回调。
+    checkpoint 只用于第一阶段，batch_sizes 为第一阶段的分批方式，应与生成断点编号时使用的一致；
+    未提供时与第二阶段一样，adaptive_batching 为真时按token预算切分，否则按 batch_size 等分。
+    本次标注却没有置信度的结果（接口未返回logprobs）同样升级，报告中的 unscored 为其条数；
+    从断点恢复的结果没有保存置信度，保留原结果。
+
+    返回 (标注结果, 置信度, 报告)。报告包含两个阶段的行数、用时和费用，以及只用强模型时的外推估算
+    （strong_only_cost / strong_only_seconds）：按第二阶段同样的格式和分批方式标注全部数据，
+    用时按第二阶段实测的每轮并发用时乘以全部数据需要的轮数，费用按升级数据实测的单条费用。
+    """
+    def plan_stage(rows, stage_model, prompt_format):
+        if adaptive_batching:
+            return plan_batch_sizes(
+                rows, batch_size, annotation_requirements, annotation_options,
+                stage_model, max_tokens, prompt_format
+            )
+        return fixed_batch_sizes(len(rows), batch_size)
+    
+    def run_stage(stage, stage_annotator, stage_model, rows, stage_checkpoint, batch_sizes=None):
+        if batch_sizes is None:
+            batch_sizes = plan_stage(rows, stage_model, stage_annotator.prompt_format)
+        started_at = time.monotonic()
+        labels = annotate_concurrently(
+            stage_annotator,
+            rows,
+            batch_size,
+            annotation_requirements,
+            annotation_options,
+            model=stage_model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            max_workers=max_workers,
+            progress_callback=(
+                lambda done_rows, done_batches: progress_callback(stage, done_rows, len(rows), done_batches, len(batch_sizes))
+            ) if progress_callback else None,
+            checkpoint=stage_checkpoint,
+            batch_sizes=batch_sizes,
+            cancel_event=cancel_event
+        )
+        return labels, time.monotonic() - started_at, len(batch_sizes)
+    
+    if batch_sizes is None:
+        batch_sizes = plan_stage(data, model, annotator.prompt_format)
+    
+    # 运行前记下从断点恢复的行：这些行的置信度没有保存，保留原结果
+    restored = set()
+    if checkpoint is not None:
+        starts = [0]
+        for size in batch_sizes:
+            starts.append(starts[-1] + size)
+        for index, batch_annotations in checkpoint.load().items():
+            if 0 <= index < len(batch_sizes) and len(batch_annotations) == batch_sizes[index]:
+                restored.update(range(starts[index], starts[index + 1]))
+    
+    labels, stage1_seconds, _ = run_stage(1, annotator, model, data, checkpoint, batch_sizes)
+    confidences = [annotator.confidences.get(text) for text in data]
+    
+    # 无效结果、失败结果、低置信度结果，以及本次标注却没有置信度（接口未返回logprobs）的结果升级
+    unscored = [
+        i for i, (label, confidence) in enumerate(zip(labels, confidences))
+        if confidence is None and label in annotation_options and i not in restored
+    ]
+    if unscored:
+        annotator._notify(
+            logging.WARNING, f"{len(unscored)} 条数据未返回logprobs，没有置信度，交给 {escalation_model} 重新标注"
+        )
+    escalate = [
+        i for i, (label, confidence) in enumerate(zip(labels, confidences))
+        if label not in annotation_options
+        or (confidence is None and i not in restored)
+        or (confidence is not None and confidence < confidence_threshold)
+    ]
+    
+    stage2_seconds = 0.0
+    stage2_batches = 0
+    if escalate:
+        escalated_rows = [data[i] for i in escalate]
+        escalated_labels, stage2_seconds, stage2_batches = run_stage(2, escalation_annotator, escalation_model, escalated_rows, None)
+        for i, label in zip(escalate, escalated_labels):
+            labels[i] = label
+            confidences[i] = escalation_annotator.confidences.get(data[i])
+    
+    stage1_cost = estimate_cost(model, annotator.prompt_tokens, annotator.completion_tokens, annotator.cached_tokens)
+    stage2_cost = estimate_cost(
+        escalation_model, escalation_annotator.prompt_tokens,
+        escalation_annotator.completion_tokens, escalation_annotator.cached_tokens
+    )
+    if escalate:
+        # 与第二阶段同样的格式和分批方式标注全部数据：用时按并发轮数外推，费用按条数外推
+        def waves(batches):
+            return math.ceil(batches / max(1, max_workers))
+        
+        strong_only_batches = len(plan_stage(data, escalation_model, escalation_annotator.prompt_format))
+        strong_only_seconds = stage2_seconds / waves(stage2_batches) * waves(strong_only_batches)
+        strong_only_cost = stage2_cost * len(data) / len(escalate) if stage2_cost is not None else None
+    else:
+        # 没有升级数据时按第一阶段的token用量以强模型价格估算
+        strong_only_cost = estimate_cost(
+            escalation_model, annotator.prompt_tokens, annotator.completion_tokens, annotator.cached_tokens
+        )
+        strong_only_seconds = None
+    
+    report = {
+        "rows": len(data),
+        "escalated": len(escalate),
+        "unscored": len(unscored),
+        "stage1_seconds": stage1_seconds,
+        "stage2_seconds": stage2_seconds,
+        "stage1_cost": stage1_cost,
+        "stage2_cost": stage2_cost,
+        "cascade_cost": stage1_cost + stage2_cost if stage1_cost is not None and stage2_cost is not None else None,
+        "cascade_seconds": stage1_seconds + stage2_seconds,
+        "strong_only_cost": strong_only_cost,
+        "strong_only_seconds": strong_only_seconds,
+    }
+    return labels, confidences, report
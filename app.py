@@ -1,32 +1,31 @@
 import streamlit as st
 import pandas as pd
-import io
+import numpy as np
 import base64
-from typing import List, Dict, Any, Optional
-import openai
-from openai import OpenAI
-from pydantic import BaseModel
-import json
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 import os
+import re
+import logging
 from dotenv import load_dotenv
-import plotly.express as px
-import plotly.graph_objects as go
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode
+from annotation_cache import AnnotationCache
+from job_checkpoint import JobCheckpoint
+from capability_registry import CapabilityRegistry
+from model_catalog import ModelCatalog
+from prompt_formats import LOGPROB_OPTION_CODES, PROMPT_FORMAT_JSON, PROMPT_FORMAT_LOGPROB, PROMPT_FORMATS, estimate_token_savings
+from batching import fixed_batch_sizes, plan_batch_sizes
+from file_io import read_table, export_dataframe
+from job_queue import JobManager, JOB_DONE, JOB_FAILED, JOB_STATUS_LABELS
+from metrics import RunMetrics
+from cost_estimator import count_unique_rows, estimate_job
+from row_texts import build_row_texts, deduplicate_rows
+
+# openai SDK、标注器和图表库加载较慢，在首次使用时才导入，登录页和配置页不必等待
+if TYPE_CHECKING:
+    from client_registry import ClientRegistry
 
 # 加载环境变量
 load_dotenv()
 
-# 定义结构化输出模型
-class AnnotationResult(BaseModel):
-    """标注结果的结构化模型"""
-    annotations: List[str]
-    
-class SingleAnnotation(BaseModel):
-    """单个标注的结构化模型"""
-    text: str
-    label: str
-    confidence: Optional[float] = None
-
 # 页面配置
 st.set_page_config(
     page_title="AI Excel 智能标注工具",
@@ -81,7 +80,7 @@ def check_authentication():
     return True
 
 # 自定义CSS样式
-st.markdown("""
+APP_CSS = """
 <style>
     /* 全局样式 */
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
@@ -366,280 +365,276 @@ st.markdown("""
         border-radius: 0.25rem !important;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def get_app_css() -> str:
+    """去掉注释和多余空白后的页面样式，每个进程只处理一次，减少每次重新运行发送到浏览器的内容"""
+    css = re.sub(r"/\*.*?\*/", "", APP_CSS, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};,>])\s*", r"\1", css).strip()
+
+st.markdown(get_app_css(), unsafe_allow_html=True)
 
-class AIAnnotator:
-    """AI标注器类"""
+@st.cache_resource
+def get_client_registry() -> "ClientRegistry":
+    """获取进程内共享的OpenAI客户端登记表，跨会话复用连接池"""
+    from client_registry import ClientRegistry
     
-    def __init__(self, api_key: str, base_url: str = None):
-        """初始化AI标注器"""
-        if not api_key:
-            raise ValueError("需要提供OpenAI API密钥")
-        
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
-        
+    return ClientRegistry()
+
+@st.cache_resource
+def get_model_catalog() -> ModelCatalog:
+    """获取进程内共享的模型列表缓存，有效期由 MODEL_CATALOG_TTL_SECONDS 控制"""
+    return ModelCatalog(ttl_seconds=float(os.getenv("MODEL_CATALOG_TTL_SECONDS", "3600")))
+
+def fetch_models(api_key: str, base_url: Optional[str], refresh: bool = False) -> tuple[bool, str, list]:
+    """测试连接并获取可用模型列表，优先使用缓存；refresh 为 True 时忽略缓存重新获取"""
+    catalog = get_model_catalog()
+    if refresh:
+        catalog.invalidate(api_key, base_url)
+    else:
+        models = catalog.get(api_key, base_url)
+        if models is not None:
+            return True, f"连接成功！找到 {len(models)} 个可用的聊天模型（模型列表来自缓存）", models
     
-    def test_connection(self) -> tuple[bool, str, list]:
-        """测试API连接并获取可用模型列表"""
-        try:
-            # 测试连接并获取模型列表
-            models_response = self.client.models.list()
-            models = []
-            
-            # 过滤出常用的聊天模型
-            chat_models = []
-            for model in models_response.data:
-                model_id = model.id
-                # 筛选常用的聊天模型
-                if any(keyword in model_id.lower() for keyword in [
-                    'gpt-3.5', 'gpt-4', 'gpt-35', 'claude', 'chat', 'turbo', 'gemini', 'flash'
-                ]):
-                    chat_models.append(model_id)
-                models.append(model_id)
-            
-            # 如果没有找到聊天模型，使用所有模型
-            if not chat_models:
-                chat_models = models
-            
-            # 排序模型列表
-            chat_models.sort()
-            
-            return True, f"连接成功！找到 {len(chat_models)} 个可用的聊天模型", chat_models
-            
-        except Exception as e:
-            return False, f"连接失败: {str(e)}", []
+    from annotator import AIAnnotator
     
-    def test_annotation(self, model: str = "gpt-3.5-turbo") -> tuple[bool, str, dict]:
-        """测试标注功能"""
-        try:
-            # 多样化的测试数据
-            test_data = [
-                "这个产品很棒，我很满意！拍照效果超出预期。",
-                "价格太贵了，性价比不高，不推荐购买。", 
-                "产品质量还行，有优点也有缺点，总体来说一般般。"
-            ]
-            test_requirements = "判断用户对产品的情感态度"
-            test_options = ["正面", "负面", "中性"]
-            
-            # 调用标注，使用更大的 max_tokens
-            result = self.annotate_batch(
-                test_data, 
-                test_requirements, 
-                test_options, 
-                model=model,
-                temperature=0.1,
-                max_tokens=1000
-            )
-            
-            if result and len(result) > 0 and result[0] != "标注失败":
-                test_info = {
-                    "test_data": test_data,
-                    "requirements": test_requirements,
-                    "options": test_options,
-                    "results": result
-                }
-                return True, "测试成功！", test_info
-            else:
-                return False, "测试失败：未获得有效标注结果", {}
-                
-        except Exception as e:
-            return False, f"测试失败: {str(e)}", {}
-    
-    def annotate_batch(self, data: List[str], annotation_requirements: str, 
-                      annotation_options: List[str], model: str = "gpt-3.5-turbo",
-                      temperature: float = 0.1, max_tokens: int = 2000) -> List[str]:
-        """批量标注数据 - 优先使用结构化输出"""
-        try:
-            # 构建提示词
-            prompt = f"""
-你是一个专业的数据标注助手。请根据以下要求对数据进行标注：
+    annotator = AIAnnotator(api_key, base_url, clients=get_client_registry())
+    success, message, models = annotator.test_connection()
+    if success:
+        catalog.set(api_key, base_url, models)
+    return success, message, models
 
-标注要求：{annotation_requirements}
+@st.cache_resource
+def get_capability_registry() -> CapabilityRegistry:
+    """获取进程内共享的模型能力登记表"""
+    return CapabilityRegistry()
 
-可选标注选项：{', '.join(annotation_options)}
+def show_annotator_message(level: int, message: str):
+    """在页面上展示标注器的警告和错误"""
+    if level >= logging.ERROR:
+        st.error(message)
+    else:
+        st.warning(message)
 
-请对以下数据进行标注，为每个数据项选择最合适的标注选项。
-如果数据不符合任何选项，请选择最接近的选项或标注为"其他"。
+@st.cache_resource
+def get_annotation_cache() -> AnnotationCache:
+    """获取进程内共享的标注结果缓存"""
+    return AnnotationCache(
+        max_entries=int(os.getenv("ANNOTATION_CACHE_MAX_ENTRIES", "200000")),
+        max_age_days=float(os.getenv("ANNOTATION_CACHE_MAX_AGE_DAYS", "30"))
+    )
 
-数据：
-{json.dumps(data, ensure_ascii=False, indent=2)}
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """获取进程内共享的后台任务管理器，同时运行的任务数由 ANNOTATION_JOB_WORKERS 控制"""
+    return JobManager(max_running_jobs=int(os.getenv("ANNOTATION_JOB_WORKERS", "2")))
 
-重要要求：
-1. 返回的标注数量必须与输入数据数量完全一致
-2. 每个标注都必须是提供的选项之一
-"""
+def load_job_result(job):
+    """将已完成任务的结果载入当前会话"""
+    annotated_df, annotation_column = job.result
+    st.session_state.annotated_df = annotated_df
+    st.session_state.annotation_column = annotation_column
+    st.session_state.annotated_at = pd.Timestamp.fromtimestamp(job.finished_at)
+    # 新结果生成后清空旧的导出内容、标注分布和筛选结果
+    st.session_state.export_cache = {}
+    st.session_state.result_cache = {}
+    st.session_state.loaded_job_id = job.id
 
-            # 第一步：尝试结构化输出
-            try:
-                response = self.client.beta.chat.completions.parse(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "你是一个专业的数据标注助手，请严格按照要求进行标注。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    response_format=AnnotationResult,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                
-                if response and response.choices and response.choices[0].message.parsed:
-                    parsed_result = response.choices[0].message.parsed
-                    annotations = parsed_result.annotations
-                    
-                    # 验证标注数量
-                    if len(annotations) == len(data):
-                        return annotations
-                    else:
-                        st.warning(f"结构化输出标注数量不匹配，回退到普通模式")
-                        
-            except Exception as e:
-                st.warning(f"结构化输出失败: {str(e)}，回退到普通模式")
-            
-            # 第二步：回退到传统JSON输出
-            return self.annotate_batch_fallback(data, annotation_requirements, annotation_options, model, temperature, max_tokens)
-                
-        except Exception as e:
-            st.error(f"AI标注出错：{str(e)}")
-            return ["标注失败"] * len(data)
+def render_job_status(job):
+    """展示后台任务的进度、运行指标和最近的消息"""
+    st.progress(job.progress)
+    st.text(f"[{JOB_STATUS_LABELS[job.status]}] {job.status_text}")
+    if job.metrics is not None:
+        render_run_metrics(job.metrics, job.id)
     
-    def annotate_batch_fallback(self, data: List[str], annotation_requirements: str, 
-                              annotation_options: List[str], model: str = "gpt-3.5-turbo",
-                              temperature: float = 0.1, max_tokens: int = 2000) -> List[str]:
-        """传统JSON输出模式（回退方案）"""
-        try:
-            # 构建提示词
-            prompt = f"""
-你是一个专业的数据标注助手。请根据以下要求对数据进行标注：
+    for level, message in list(job.messages)[-5:]:
+        show_annotator_message(level, message)
 
-标注要求：{annotation_requirements}
+@st.fragment(run_every=1.0)
+def render_job_progress(job_id: str):
+    """展示运行中的后台任务，每秒只重新运行本片段；任务结束后刷新整个页面，之后不再轮询"""
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    
+    render_job_status(job)
+    if st.button("⏹️ 取消任务", key=f"cancel_{job.id}"):
+        manager.cancel(job.id)
 
-可选标注选项：{', '.join(annotation_options)}
+def render_finished_job(job):
+    """展示已结束的任务：载入结果并显示汇总信息，不再定时刷新"""
+    if job.status == JOB_DONE and st.session_state.get('loaded_job_id') != job.id:
+        load_job_result(job)
+    
+    render_job_status(job)
+    if job.status == JOB_FAILED:
+        st.error(job.status_text)
+    for level, message in job.summary:
+        getattr(st, level)(message)
 
-请对以下数据进行标注，为每个数据项选择最合适的标注选项。
-如果数据不符合任何选项，请选择最接近的选项或标注为"其他"。
+def format_seconds(seconds: Optional[float]) -> str:
+    """把秒数格式化为 时:分:秒 或 分:秒"""
+    if seconds is None:
+        return "--"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
 
-数据：
-{json.dumps(data, ensure_ascii=False, indent=2)}
+def render_paginated_dataframe(df: pd.DataFrame, key: str, positions: Optional[np.ndarray] = None,
+                               page_sizes: tuple = (10, 20, 50, 100), default_page_size: int = 20):
+    """分页显示数据，只把当前页发送到浏览器，避免大文件每次重新运行都序列化全部数据
+    
+    positions 为筛选后的行位置，提供时只在这些行中分页，不复制筛选后的整张表。
+    """
+    total_rows = len(df) if positions is None else len(positions)
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox("每页行数", list(page_sizes), index=list(page_sizes).index(default_page_size),
+                                 key=f"{key}_page_size")
+    total_pages = max(1, -(-total_rows // page_size))
+    
+    # 筛选条件或每页行数变化后页码可能超出范围，在创建控件前修正
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > total_pages:
+        st.session_state[page_key] = total_pages
+    with col2:
+        page = st.number_input(f"页码（共 {total_pages} 页）", min_value=1, max_value=total_pages,
+                               value=1, step=1, key=page_key)
+    
+    start = (int(page) - 1) * page_size
+    end = min(start + page_size, total_rows)
+    with col3:
+        st.caption(f"第 {start + 1 if total_rows else 0}–{end} 行，共 {total_rows:,} 行")
+    page_df = df.iloc[start:end] if positions is None else df.iloc[positions[start:end]]
+    st.dataframe(page_df, use_container_width=True)
 
-请直接返回JSON格式结果，不要使用代码块包裹：
-{{"annotations": ["标注1", "标注2", "标注3", ...]}}
+def render_job_estimate(df: pd.DataFrame, columns: List[str], annotation_requirements: str,
+                        annotation_options: List[str], model: Optional[str], prompt_format: str,
+                        batch_size: int, max_workers: int, adaptive_batching: bool):
+    """在开始标注前展示预估的请求数、token用量、用时和费用"""
+    if not model:
+        return
+    
+    # 唯一文本数需要遍历全部数据，同一份数据和标注列只计算一次
+    unique_key = (id(df), len(df), tuple(columns))
+    cached = st.session_state.get('unique_rows_cache')
+    if cached is None or cached[0] != unique_key:
+        cached = (unique_key, count_unique_rows(df, columns))
+        st.session_state.unique_rows_cache = cached
+    
+    max_tokens_str = st.session_state.get('advanced_max_tokens', '不限制')
+    estimate = estimate_job(
+        df, columns, annotation_requirements, annotation_options, model, prompt_format,
+        batch_size, int(max_tokens_str) if max_tokens_str != '不限制' else 8000, max_workers,
+        adaptive_batching=adaptive_batching, unique_rows=cached[1],
+        requests_per_minute=st.session_state.get('advanced_rpm', 0),
+        tokens_per_minute=st.session_state.get('advanced_tpm', 0)
+    )
+    if estimate['cost'] is None:
+        cost = "未知（模型不在价格表中）"
+    else:
+        cost = f"${estimate['cost']:.2f}" if estimate['cost'] >= 1 else f"${estimate['cost']:.4f}"
+    st.info(
+        f"🧮 预估：{estimate['unique_rows']} 条唯一文本，约 {estimate['requests']} 次请求，"
+        f"输入 {estimate['input_tokens']:,} token（可命中提示词缓存 {estimate['cached_tokens']:,}）、"
+        f"输出 {estimate['output_tokens']:,} token，并发 {max_workers} 时约需 {format_seconds(estimate['seconds'])}，"
+        f"{model} 预计花费 {cost}"
+    )
+    with st.expander("💲 各模型预计费用"):
+        costs = sorted(
+            ((name, value) for name, value in estimate['costs'].items() if value is not None),
+            key=lambda item: item[1]
+        )
+        st.dataframe(
+            pd.DataFrame(costs, columns=["模型", "预计费用（美元）"]).round(4),
+            hide_index=True, use_container_width=True
+        )
+        st.caption("按分层抽样的样本估算，未计入标注缓存命中和失败重试；价格见 pricing.py")
 
-重要要求：
-1. 只返回纯JSON，不要添加```或其他格式
-2. 返回的标注数量必须与输入数据数量完全一致
-3. 每个标注都必须是提供的选项之一
-"""
+def render_run_metrics(metrics: RunMetrics, key: str):
+    """展示任务的实时指标：吞吐、剩余时间、花费和请求耗时，详情中列出token、重试、回退和失败原因"""
+    snapshot = metrics.snapshot()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("吞吐", f"{snapshot['rows_per_second']:.1f} 行/秒")
+    col2.metric("预计剩余", format_seconds(snapshot['eta_seconds']) if metrics.finished_at is None else "0:00")
+    col3.metric(
+        "已花费", f"${snapshot['cost']:.4f}",
+        help=None if snapshot['cost_complete'] else "部分模型不在价格表中，未计入费用"
+    )
+    if snapshot['latency_p50'] is not None:
+        col4.metric("请求耗时 p50 / p99", f"{snapshot['latency_p50']:.1f}s / {snapshot['latency_p99']:.1f}s")
+    
+    with st.expander("📈 运行指标"):
+        st.markdown(
+            f"请求 {snapshot['requests']} 次（失败 {snapshot['errors']} 次）· "
+            f"输入 {snapshot['prompt_tokens']} token（命中提示词缓存 {snapshot['cached_tokens']}）· "
+            f"输出 {snapshot['completion_tokens']} token"
+        )
+        for title, counts in (("重试原因", snapshot['retries']), ("回退路径", snapshot['fallbacks']), ("失败原因（行数）", snapshot['failures'])):
+            if counts:
+                st.markdown(f"{title}：" + "，".join(f"`{name}` {count}" for name, count in counts.items()))
+        col1, col2 = st.columns(2)
+        col1.download_button(
+            "导出JSON", metrics.to_json(), file_name=f"metrics_{key}.json",
+            mime="application/json", key=f"metrics_json_{key}", use_container_width=True
+        )
+        col2.download_button(
+            "导出Prometheus", metrics.to_prometheus(), file_name=f"metrics_{key}.prom",
+            mime="text/plain", key=f"metrics_prom_{key}", use_container_width=True
+        )
 
-            # 准备请求参数（包含安全设置）
-            request_params = {
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": "你是一个专业的数据标注助手，请严格按照要求进行标注。"},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": temperature,
-                "max_tokens": max_tokens
-            }
+def format_cascade_report(report: Dict[str, Any], model: str, escalation_model: str) -> str:
+    """生成模型级联与只用强模型的费用、用时对比说明"""
+    def money(value):
+        return f"${value:.4f}" if value is not None else "未知（模型不在价格表中）"
+    
+    def seconds(value):
+        return f"{value:.1f}s" if value is not None else "无法估算（没有升级数据）"
+    
+    lines = [
+        f"🪜 模型级联：{report['escalated']}/{report['rows']} 条唯一文本（{report['escalated'] / max(1, report['rows']):.0%}）"
+        f"从 {model} 升级到 {escalation_model}"
+        + (f"，其中 {report['unscored']} 条因接口未返回logprobs（没有置信度）而升级" if report.get('unscored') else ""),
+        f"级联费用 {money(report['cascade_cost'])}，用时 {seconds(report['cascade_seconds'])}"
+        f"（第一阶段 {report['stage1_seconds']:.1f}s，第二阶段 {report['stage2_seconds']:.1f}s）",
+        f"只用 {escalation_model}（按升级数据实测外推）预计费用 {money(report['strong_only_cost'])}，"
+        f"用时 {seconds(report['strong_only_seconds'])}",
+    ]
+    if report['cascade_cost'] is not None and report['strong_only_cost']:
+        saving = 1 - report['cascade_cost'] / report['strong_only_cost']
+        lines.append(f"费用节省约 {saving:.0%}" if saving >= 0 else f"费用增加约 {-saving:.0%}，建议提高第一阶段模型的准确率或降低置信度阈值")
+    return "\n\n".join(lines)
 
-            response = self.client.chat.completions.create(**request_params)
-            
-            # 检查响应是否为空
-            if not response or not response.choices:
-                st.error("AI返回空响应，请检查API配置")
-                return ["标注失败"] * len(data)
-            
-            # 解析响应
-            choice = response.choices[0]
-            
-            # 检查消息是否存在
-            if not choice.message or not hasattr(choice.message, 'content'):
-                st.error("AI响应格式错误，未包含有效内容")
-                return ["标注失败"] * len(data)
-            
-            result_text = choice.message.content
-            
-            # 检查响应是否被截断
-            if choice.finish_reason == 'length':
-                st.error(f"AI响应被截断，请增加最大输出长度。当前设置: {max_tokens}")
-                return ["标注失败"] * len(data)
-            
-            if result_text is None or result_text.strip() == "":
-                st.error("AI返回空响应内容")
-                return ["标注失败"] * len(data)
-            
-            result_text = result_text.strip()
-            
-            # 清理响应文本，处理各种可能的格式
-            def clean_json_response(text):
-                text = text.strip()
-                
-                # 处理markdown代码块
-                if text.startswith('```'):
-                    lines = text.split('\n')
-                    if len(lines) >= 3:
-                        # 去掉第一行和最后一行
-                        text = '\n'.join(lines[1:-1]).strip()
-                
-                # 处理可能的额外文字说明
-                if '{' in text and '}' in text:
-                    # 提取JSON部分
-                    start = text.find('{')
-                    end = text.rfind('}') + 1
-                    text = text[start:end]
-                
-                return text.strip()
-            
-            result_text = clean_json_response(result_text)
-            
-            # 尝试解析JSON
-            try:
-                result_json = json.loads(result_text)
-                annotations = result_json.get("annotations", [])
-                
-                # 验证标注数量
-                if len(annotations) != len(data):
-                    st.error(f"标注数量不匹配：期望 {len(data)}，实际 {len(annotations)}")
-                    return ["标注失败"] * len(data)
-                
-                return annotations
-            except json.JSONDecodeError as e:
-                st.error(f"AI响应格式错误，无法解析JSON。")
-                st.error(f"错误详情: {str(e)}")
-                st.error(f"处理后的响应: {result_text[:200]}...")
-                return ["标注失败"] * len(data)
-                
-        except Exception as e:
-            st.error(f"AI标注出错：{str(e)}")
-            return ["标注失败"] * len(data)
+# 置信度低于此值的结果提示人工复核
+LOW_CONFIDENCE_THRESHOLD = 0.6
+
+# 导出格式：显示名称 -> (扩展名, MIME类型)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "JSON": ("json", "application/json"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Feather": ("feather", "application/vnd.apache.arrow.file"),
+}
 
-def load_file(uploaded_file) -> Optional[pd.DataFrame]:
+def load_file(uploaded_file, dtype_backend: Optional[str] = None) -> Optional[pd.DataFrame]:
     """加载上传的文件"""
     try:
         file_extension = uploaded_file.name.split('.')[-1].lower()
         
-        if file_extension == 'csv':
-            # 尝试不同的编码
-            encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
-            for encoding in encodings:
-                try:
-                    uploaded_file.seek(0)
-                    df = pd.read_csv(uploaded_file, encoding=encoding)
-                    return df
-                except UnicodeDecodeError:
-                    continue
-            st.error("无法读取CSV文件，请检查文件编码")
+        if file_extension not in ['csv', 'xlsx', 'xls', 'parquet', 'feather', 'arrow']:
+            st.error("不支持的文件格式，请上传CSV、Excel、Parquet或Feather文件")
             return None
-            
-        elif file_extension in ['xlsx', 'xls']:
-            df = pd.read_excel(uploaded_file, engine='openpyxl' if file_extension == 'xlsx' else 'xlrd')
-            return df
-        else:
-            st.error("不支持的文件格式，请上传CSV或Excel文件")
-            return None
-            
+        
+        # CSV单次探测编码后分块解析，xlsx以只读模式流式读取，Parquet/Feather直接按列读取
+        return read_table(uploaded_file, uploaded_file.name, dtype_backend=dtype_backend)
+        
+    except UnicodeDecodeError:
+        st.error("无法读取CSV文件，请检查文件编码")
+        return None
     except Exception as e:
         st.error(f"文件加载失败：{str(e)}")
         return None
@@ -738,14 +733,21 @@ def main():
         )
         
         # API连接测试
-        if st.button("🔗 测试API连接", use_container_width=True):
+        col_test, col_refresh = st.columns([3, 1])
+        with col_test:
+            test_clicked = st.button("🔗 测试API连接", use_container_width=True)
+        with col_refresh:
+            refresh_clicked = st.button("🔄", help="忽略缓存，重新获取模型列表", use_container_width=True)
+        
+        if test_clicked or refresh_clicked:
             if not api_key:
                 st.error("请先输入API密钥")
             else:
                 with st.spinner("正在测试连接..."):
                     try:
-                        annotator = AIAnnotator(api_key, base_url if base_url else None)
-                        success, message, models = annotator.test_connection()
+                        success, message, models = fetch_models(
+                            api_key, base_url if base_url else None, refresh=refresh_clicked
+                        )
                         
                         if success:
                             st.success(message)
@@ -772,6 +774,12 @@ def main():
                 "gpt-4o-mini"
             ]
         
+        # 之前获取过模型列表时直接使用缓存，无需再次测试连接
+        if api_key and not st.session_state.get('api_connected'):
+            cached_models = get_model_catalog().get(api_key, base_url if base_url else None)
+            if cached_models:
+                st.session_state.available_models = cached_models
+        
         # 从环境变量获取默认模型
         default_model = os.getenv("DEFAULT_MODEL", "")
         default_index = None
@@ -791,6 +799,31 @@ def main():
             help="选择用于标注的AI模型，不同模型效果和费用不同。可通过环境变量 DEFAULT_MODEL 设置默认值（支持任何模型名称，如 gemini-2.5-flash）"
         )
         
+        # 模型级联：便宜模型先标注，低置信度的数据交给强模型
+        use_cascade = st.checkbox(
+            "启用模型级联",
+            value=False,
+            help="先用上面选择的模型以单字母分类方式标注并得到置信度，只把低置信度或无效的结果交给升级模型重新标注"
+        )
+        escalation_model = None
+        confidence_threshold = 0.8
+        if use_cascade:
+            escalation_model = st.selectbox(
+                "升级模型",
+                options=st.session_state.available_models,
+                index=None,
+                placeholder="请选择更强的模型",
+                help="用于重新标注低置信度数据的模型，按「提示词格式」中的设置请求"
+            )
+            confidence_threshold = st.slider(
+                "置信度阈值",
+                min_value=0.5,
+                max_value=0.99,
+                value=0.8,
+                step=0.01,
+                help="第一阶段置信度低于此值的数据升级到更强的模型"
+            )
+        
         # 显示连接状态
         if 'api_connected' in st.session_state:
             if st.session_state.api_connected:
@@ -813,7 +846,15 @@ def main():
                     else:
                         with st.spinner("正在测试标注..."):
                             try:
-                                annotator = AIAnnotator(api_key, base_url if base_url else None)
+                                from annotator import AIAnnotator
+                                
+                                annotator = AIAnnotator(
+                                    api_key, base_url if base_url else None,
+                                    capabilities=get_capability_registry(),
+                                    message_handler=show_annotator_message,
+                                    clients=get_client_registry(),
+                                    prompt_format=st.session_state.get('prompt_format', PROMPT_FORMAT_JSON)
+                                )
                                 test_success, test_message, test_info = annotator.test_annotation(selected_model)
                                 
                                 if test_success:
@@ -827,19 +868,25 @@ def main():
                                         st.markdown("**可选标注选项：**")
                                         st.write(", ".join(test_info["options"]))
                                         
+                                        if "output_mode" in test_info:
+                                            st.markdown("**输出模式：**")
+                                            st.write(test_info["output_mode"])
+                                        
                                         st.markdown("**测试数据和结果：**")
-                                        for i, (data, result) in enumerate(zip(test_info["test_data"], test_info["results"])):
+                                        confidences = test_info.get("confidences") or [None] * len(test_info["results"])
+                                        for i, (data, result, confidence) in enumerate(zip(test_info["test_data"], test_info["results"], confidences)):
                                             col1, col2 = st.columns([3, 1])
+                                            label = f"{result}（{confidence:.0%}）" if confidence is not None else result
                                             with col1:
                                                 st.write(f"📝 **数据 {i+1}：** {data}")
                                             with col2:
                                                 # 根据标注结果设置不同颜色
                                                 if result == "正面":
-                                                    st.success(f"✅ {result}")
+                                                    st.success(f"✅ {label}")
                                                 elif result == "负面":
-                                                    st.error(f"❌ {result}")
+                                                    st.error(f"❌ {label}")
                                                 else:
-                                                    st.info(f"🔵 {result}")
+                                                    st.info(f"🔵 {label}")
                                 else:
                                     st.error(test_message)
                             except Exception as e:
@@ -851,16 +898,68 @@ def main():
         
         # 批次设置
         st.markdown("#### 📊 处理设置")
-        batch_size = st.slider(
-            "批次大小",
-            min_value=5,
-            max_value=20,
-            value=10,
-            help="每次处理的数据条数。如果每项文本量很大，建议选择较小的批次大小（5-8）以提高稳定性"
+        adaptive_batching = st.checkbox(
+            "按Token自适应批次",
+            value=True,
+            help="根据每条文本的长度、模型上下文长度和最大输出长度自动决定每批条数：短文本合并成大批次，长文本拆成小批次，避免响应被截断"
+        )
+        
+        if adaptive_batching:
+            batch_size = st.slider(
+                "单批最大条数",
+                min_value=5,
+                max_value=200,
+                value=50,
+                help="自适应批次的条数上限，实际条数由token预算决定"
+            )
+        else:
+            batch_size = st.slider(
+                "批次大小",
+                min_value=5,
+                max_value=20,
+                value=10,
+                help="每次处理的数据条数。如果每项文本量很大，建议选择较小的批次大小（5-8）以提高稳定性"
+            )
+            
+            if batch_size > 15:
+                st.warning("⚠️ 批次较大时，如果单条文本内容很长，可能会导致处理不稳定，建议适当减小批次大小")
+        
+        prompt_format = st.selectbox(
+            "提示词格式",
+            options=list(PROMPT_FORMATS.keys()),
+            format_func=PROMPT_FORMATS.get,
+            key="prompt_format",
+            help="紧凑格式将数据逐行编号、模型只返回选项编号，在本地映射回选项文字，输入和输出token都更少；JSON格式优先使用结构化输出；单字母分类适合2-20个选项，每条数据只输出一个token，并根据logprobs给出置信度"
         )
         
-        if batch_size > 15:
-            st.warning("⚠️ 批次较大时，如果单条文本内容很长，可能会导致处理不稳定，建议适当减小批次大小")
+        max_workers = st.slider(
+            "并发请求数",
+            min_value=1,
+            max_value=16,
+            value=4,
+            help="同时发送的批次请求数量。并发越高速度越快，但更容易触发API限流"
+        )
+        
+        use_cache = st.checkbox(
+            "启用结果缓存",
+            value=True,
+            help="相同模型、参数、标注要求和选项下已标注过的文本直接复用结果，不再重复调用API"
+        )
+        
+        if use_cache:
+            cache_stats = get_annotation_cache().stats()
+            st.caption(
+                f"💾 缓存条目 {cache_stats['entries']} · 命中 {cache_stats['hits']} · 未命中 {cache_stats['misses']}"
+            )
+            if st.button("🗑️ 清空缓存", use_container_width=True):
+                get_annotation_cache().clear()
+                st.rerun()
+        
+        use_checkpoint = st.checkbox(
+            "启用断点续传",
+            value=True,
+            help="每完成一批就保存进度。页面刷新或服务重启后，以相同文件和配置重新开始标注即可从断点继续"
+        )
         
         # 高级设置
         st.markdown("#### ⚙️ 高级设置")
@@ -884,6 +983,40 @@ def main():
                 help="限制AI响应的最大长度，选择'不限制'获得最佳效果",
                 key="advanced_max_tokens"
             )
+            
+            requests_per_minute = st.number_input(
+                "每分钟请求数上限 (RPM)",
+                min_value=0,
+                value=0,
+                step=10,
+                help="客户端限流，0 表示不限制。请参考API服务商给出的额度设置",
+                key="advanced_rpm"
+            )
+            
+            tokens_per_minute = st.number_input(
+                "每分钟Token上限 (TPM)",
+                min_value=0,
+                value=0,
+                step=10000,
+                help="按提示词长度估算的输入token限流，0 表示不限制",
+                key="advanced_tpm"
+            )
+            
+            max_retries = st.slider(
+                "最大重试次数",
+                min_value=0,
+                max_value=10,
+                value=5,
+                help="遇到限流(429)或服务端错误(5xx)时自动重试，优先按 Retry-After 等待，否则指数退避",
+                key="advanced_max_retries"
+            )
+            
+            st.checkbox(
+                "使用PyArrow数据类型",
+                value=False,
+                help="上传文件以PyArrow列式类型加载，大文件的字符串列内存占用明显降低",
+                key="advanced_pyarrow_dtypes"
+            )
         
         # 用户信息和退出登录 - 放在底部
         st.markdown("<br><br>", unsafe_allow_html=True)
@@ -941,9 +1074,9 @@ def main():
     
     # 简化文件上传区域
     uploaded_file = st.file_uploader(
-        "选择CSV或Excel文件",
-        type=['csv', 'xlsx', 'xls'],
-        help="支持CSV、XLSX、XLS格式"
+        "选择CSV、Excel、Parquet或Feather文件",
+        type=['csv', 'xlsx', 'xls', 'parquet', 'feather', 'arrow'],
+        help="支持CSV、XLSX、XLS、Parquet、Feather(Arrow)格式，大文件推荐使用Parquet或Feather"
     )
     
     if not uploaded_file:
@@ -955,8 +1088,15 @@ def main():
     
     if uploaded_file is not None:
         # 加载文件
-        with st.spinner("正在加载文件..."):
-            df = load_file(uploaded_file)
+        # 同一个上传文件只解析一次，页面交互触发的重新运行直接复用
+        dtype_backend = 'pyarrow' if st.session_state.get('advanced_pyarrow_dtypes', False) else None
+        file_key = (uploaded_file.file_id, dtype_backend)
+        if st.session_state.get('loaded_file_key') == file_key and st.session_state.get('df') is not None:
+            df = st.session_state.df
+        else:
+            with st.spinner("正在加载文件..."):
+                df = load_file(uploaded_file, dtype_backend=dtype_backend)
+            st.session_state.loaded_file_key = file_key if df is not None else None
         
         if df is not None:
             st.session_state.df = df
@@ -976,11 +1116,8 @@ def main():
         
         st.markdown('<div class="section-header">👀 数据预览</div>', unsafe_allow_html=True)
         
-        # 预览选项
-        preview_rows = st.selectbox("预览行数", [10, 20, 50, 100], index=1)
-        
-        # 显示数据
-        st.dataframe(df.head(preview_rows), use_container_width=True)
+        # 分页显示数据
+        render_paginated_dataframe(df, "preview")
         
         # 列选择
         st.markdown('<div class="section-header">📋 选择标注列</div>', unsafe_allow_html=True)
@@ -1025,6 +1162,20 @@ def main():
                 # 解析标注选项
                 annotation_options = [opt.strip() for opt in annotation_options_text.split('\n') if opt.strip()]
             
+            # 按样本估算两种提示词格式的token用量
+            if annotation_options:
+                savings = estimate_token_savings(build_row_texts(df.head(200), selected_columns), annotation_options)
+                st.caption(
+                    f"📉 按前 {min(len(df), 200)} 行估算：JSON格式每行约 {savings['json_input'] + savings['json_output']:.1f} token，"
+                    f"紧凑格式约 {savings['compact_input'] + savings['compact_output']:.1f} token"
+                    f"（输出 {savings['json_output']:.1f} → {savings['compact_output']:.1f}），可节省约 {savings['saving_ratio']:.0%}"
+                )
+                render_job_estimate(
+                    df, selected_columns, annotation_requirements, annotation_options,
+                    selected_model, PROMPT_FORMAT_LOGPROB if use_cascade else prompt_format,
+                    batch_size, max_workers, adaptive_batching
+                )
+
             # 标注列设置
             st.markdown("**结果存储：**")
             annotation_column_name = st.text_input(
@@ -1044,66 +1195,262 @@ def main():
                     st.error("请输入标注要求")
                 elif not annotation_options:
                     st.error("请输入标注选项")
+                elif use_cascade and not escalation_model:
+                    st.error("请在侧边栏选择升级模型")
                 else:
-                    try:
-                        # 初始化AI标注器
-                        annotator = AIAnnotator(api_key, base_url if base_url else None)
+                    from annotator import AIAnnotator, annotate_cascade, annotate_concurrently
+                    from rate_limiter import RateLimiter
+                    
+                    # 初始化AI标注器
+                    cache = get_annotation_cache() if use_cache else None
+                    capabilities = get_capability_registry()
+                    clients = get_client_registry()
+                    rate_limiter = RateLimiter(
+                        requests_per_minute=st.session_state.get('advanced_rpm', 0),
+                        tokens_per_minute=st.session_state.get('advanced_tpm', 0),
+                        max_concurrency=max_workers,
+                        max_retries=st.session_state.get('advanced_max_retries', 5)
+                    )
+                    
+                    # 获取高级设置参数
+                    temperature = st.session_state.get('advanced_temperature', 0.1)
+                    max_tokens_str = st.session_state.get('advanced_max_tokens', '不限制')
+                    max_tokens_value = int(max_tokens_str) if max_tokens_str != '不限制' else 8000
+                    
+                    source_df = df
+                    columns = list(selected_columns)
+                    model = selected_model
+                    
+                    # 级联模式第一阶段使用单字母分类得到置信度；单字母分类不读缓存（缓存不保存置信度）
+                    first_format = PROMPT_FORMAT_LOGPROB if use_cascade else prompt_format
+                    
+                    # 在后台工作线程中执行，页面只轮询进度，刷新页面不会中断任务
+                    def run_job(job):
+                        metrics = job.metrics = RunMetrics()
+                        annotator = AIAnnotator(
+                            api_key, base_url if base_url else None,
+                            cache=None if first_format == PROMPT_FORMAT_LOGPROB else cache, capabilities=capabilities,
+                            rate_limiter=rate_limiter,
+                            message_handler=job.add_message,
+                            clients=clients,
+                            prompt_format=first_format,
+                            metrics=metrics
+                        )
+                        annotators = [annotator]
+                        cache_before = cache.stats() if cache else None
                         
                         # 准备数据
-                        data_to_annotate = []
-                        for _, row in df.iterrows():
-                            row_data = " | ".join([str(row[col]) for col in selected_columns])
-                            data_to_annotate.append(row_data)
+                        data_to_annotate = build_row_texts(source_df, columns)
                         
-                        # 显示进度
-                        total_batches = (len(data_to_annotate) + batch_size - 1) // batch_size
+                        # 合并重复文本，只标注唯一文本
+                        unique_data, row_to_unique = deduplicate_rows(data_to_annotate)
                         
-                        # 创建进度展示区域
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
+                        # 切分批次
+                        def plan_batches(rows):
+                            if adaptive_batching:
+                                return plan_batch_sizes(
+                                    rows, batch_size, annotation_requirements, annotation_options,
+                                    model, max_tokens_value, first_format
+                                )
+                            return fixed_batch_sizes(len(rows), batch_size)
                         
-                        all_annotations = []
+                        batch_sizes = plan_batches(unique_data)
+                        total_batches = len(batch_sizes)
+                        saved_calls = 0
+                        if len(unique_data) < len(data_to_annotate):
+                            # 单字母分类（含级联的第一阶段）每条数据单独请求，合并的每条重复数据都少一次调用；
+                            # 选项过多时改用紧凑格式，仍按批次计算
+                            if first_format == PROMPT_FORMAT_LOGPROB and len(annotation_options) <= len(LOGPROB_OPTION_CODES):
+                                saved_calls = len(data_to_annotate) - len(unique_data)
+                            else:
+                                saved_calls = len(plan_batches(data_to_annotate)) - total_batches
                         
-                        # 批量处理
-                        for i in range(0, len(data_to_annotate), batch_size):
-                            batch_data = data_to_annotate[i:i + batch_size]
-                            batch_num = i // batch_size + 1
-                            
-                            status_text.text(f"正在处理第 {batch_num}/{total_batches} 批数据...")
+                        # 断点续传：相同数据和配置的任务共享同一个断点文件
+                        checkpoint = None
+                        if use_checkpoint:
+                            checkpoint_id = JobCheckpoint.make_job_id(
+                                unique_data, annotation_requirements, annotation_options,
+                                model, temperature, max_tokens_value, batch_sizes
+                            )
+                            checkpoint = JobCheckpoint(checkpoint_id)
+                            resumed_batches = len(checkpoint.load())
+                            if resumed_batches:
+                                job.add_summary('info', f"♻️ 检测到未完成的任务，已从断点恢复 {min(resumed_batches, total_batches)}/{total_batches} 批")
+                        
+                        job.update_progress(0, len(unique_data), 0, total_batches)
+                        job.status_text = f"正在处理 {total_batches} 批数据（并发 {max_workers}）..."
+                        
+                        unique_confidences = None
+                        cascade_report = None
+                        if use_cascade:
+                            escalation_annotator = AIAnnotator(
+                                api_key, base_url if base_url else None,
+                                cache=None if prompt_format == PROMPT_FORMAT_LOGPROB else cache, capabilities=capabilities,
+                                rate_limiter=rate_limiter,
+                                message_handler=job.add_message,
+                                clients=clients,
+                                prompt_format=prompt_format,
+                                metrics=metrics
+                            )
+                            annotators.append(escalation_annotator)
                             
-                            # 获取高级设置参数
-                            temperature = st.session_state.get('advanced_temperature', 0.1)
-                            max_tokens_str = st.session_state.get('advanced_max_tokens', '不限制')
-                            max_tokens_value = int(max_tokens_str) if max_tokens_str != '不限制' else 8000
+                            def update_cascade_progress(stage, done_rows, total_rows, done_batches, stage_batches):
+                                job.update_progress(done_rows, total_rows, done_batches, stage_batches)
+                                job.status_text = (
+                                    f"第一阶段（{model}）：已完成 {done_batches}/{stage_batches} 批" if stage == 1
+                                    else f"第二阶段（{escalation_model}）：已重新标注 {done_rows}/{total_rows} 条低置信度数据"
+                                )
                             
-                            # 调用AI标注
-                            batch_annotations = annotator.annotate_batch(
-                                batch_data,
+                            unique_annotations, unique_confidences, cascade_report = annotate_cascade(
+                                annotator,
+                                escalation_annotator,
+                                unique_data,
+                                batch_size,
                                 annotation_requirements,
                                 annotation_options,
-                                model=selected_model,
+                                model=model,
+                                escalation_model=escalation_model,
+                                confidence_threshold=confidence_threshold,
                                 temperature=temperature,
-                                max_tokens=max_tokens_value
+                                max_tokens=max_tokens_value,
+                                max_workers=max_workers,
+                                progress_callback=update_cascade_progress,
+                                checkpoint=checkpoint,
+                                cancel_event=job.cancel_event,
+                                batch_sizes=batch_sizes,
+                                adaptive_batching=adaptive_batching
                             )
-                            
-                            all_annotations.extend(batch_annotations)
-                            
-                            # 更新进度
-                            progress = min(1.0, len(all_annotations) / len(data_to_annotate))
-                            progress_bar.progress(progress)
+                        else:
+                            # 并发批量处理（批次可能乱序完成）
+                            unique_annotations = annotate_concurrently(
+                                annotator,
+                                unique_data,
+                                batch_size,
+                                annotation_requirements,
+                                annotation_options,
+                                model=model,
+                                temperature=temperature,
+                                max_tokens=max_tokens_value,
+                                max_workers=max_workers,
+                                progress_callback=lambda done_rows, done_batches: job.update_progress(
+                                    done_rows, len(unique_data), done_batches, total_batches
+                                ),
+                                checkpoint=checkpoint,
+                                batch_sizes=batch_sizes,
+                                cancel_event=job.cancel_event
+                            )
+                            if prompt_format == PROMPT_FORMAT_LOGPROB:
+                                unique_confidences = [annotator.confidences.get(text) for text in unique_data]
+                        
+                        # 将结果展开回所有行
+                        all_annotations = [unique_annotations[i] for i in row_to_unique]
                         
                         # 创建标注后的数据框
-                        annotated_df = df.copy()
+                        annotated_df = source_df.copy()
                         annotated_df[annotation_column_name] = all_annotations
-                        st.session_state.annotated_df = annotated_df
                         
-                        status_text.text("✅ 标注完成！")
-                        st.success(f"成功标注 {len(all_annotations)} 条数据")
+                        # 单字母分类和级联模式附加置信度列（命中缓存或断点的数据没有置信度）
+                        if unique_confidences is not None:
+                            annotated_df[f"{annotation_column_name}_置信度"] = pd.Series(
+                                [unique_confidences[i] for i in row_to_unique], index=annotated_df.index, dtype=float
+                            )
+                            scored = [confidence for confidence in unique_confidences if confidence is not None]
+                            if scored:
+                                low = sum(1 for confidence in scored if confidence < LOW_CONFIDENCE_THRESHOLD)
+                                job.add_summary(
+                                    'info',
+                                    f"🎯 平均置信度 {sum(scored) / len(scored):.1%}，"
+                                    f"{low} 条唯一文本置信度低于 {LOW_CONFIDENCE_THRESHOLD:.0%}，建议人工复核"
+                                )
+                        
+                        # 全部成功后不再需要断点
+                        if checkpoint is not None and "标注失败" not in unique_annotations:
+                            checkpoint.remove()
                         
-                    except Exception as e:
-                        st.error(f"标注过程中出现错误：{str(e)}")
+                        job.add_summary('success', f"成功标注 {len(all_annotations)} 条数据")
+                        
+                        if rate_limiter.retries:
+                            job.add_summary(
+                                'warning',
+                                f"⏳ 共重试 {rate_limiter.retries} 次，其中限流 {rate_limiter.rate_limited} 次，"
+                                f"结束时并发为 {rate_limiter.concurrency.limit}/{max_workers}"
+                            )
+                        
+                        duplicate_rows = len(data_to_annotate) - len(unique_data)
+                        if duplicate_rows > 0:
+                            job.add_summary(
+                                'info',
+                                f"🔁 去重：{len(data_to_annotate)} 条数据中有 {len(unique_data)} 条唯一文本，"
+                                f"合并 {duplicate_rows} 条重复数据，节省 {saved_calls} 次API调用"
+                            )
+                        
+                        prompt_tokens = sum(item.prompt_tokens for item in annotators)
+                        completion_tokens = sum(item.completion_tokens for item in annotators)
+                        cached_tokens = sum(item.cached_tokens for item in annotators)
+                        if prompt_tokens:
+                            job.add_summary(
+                                'info',
+                                f"🔢 实际消耗输入 {prompt_tokens} token（其中命中提示词缓存 {cached_tokens} token，"
+                                f"{cached_tokens / prompt_tokens:.0%}）、输出 {completion_tokens} token，"
+                                f"平均每条唯一文本 {(prompt_tokens + completion_tokens) / max(1, len(unique_data)):.1f} token"
+                            )
+                            snapshot = metrics.snapshot()
+                            job.add_summary(
+                                'info',
+                                f"💵 预计花费 ${snapshot['cost']:.4f}" + ("" if snapshot['cost_complete'] else "（部分模型不在价格表中，未计入）")
+                            )
+                        
+                        if cascade_report:
+                            job.add_summary('info', format_cascade_report(cascade_report, model, escalation_model))
+                        
+                        if any(item.cache is not None for item in annotators):
+                            cache_after = cache.stats()
+                            run_hits = cache_after['hits'] - cache_before['hits']
+                            run_misses = cache_after['misses'] - cache_before['misses']
+                            job.add_summary('info', f"💾 缓存命中 {run_hits} 条，未命中 {run_misses} 条（已调用API标注）")
+                        
+                        return annotated_df, annotation_column_name
+                    
+                    job = get_job_manager().submit(
+                        st.session_state.get('username', 'anonymous'),
+                        f"{uploaded_file.name if uploaded_file else '当前数据'}（{len(df)} 行）",
+                        run_job
+                    )
+                    st.session_state.active_job_id = job.id
             st.markdown('</div>', unsafe_allow_html=True)
     
+    # 当前任务进度：运行中由片段每秒刷新，结束后只展示结果
+    active_job = get_job_manager().get(st.session_state.active_job_id) if st.session_state.get('active_job_id') else None
+    if active_job is None:
+        st.session_state.active_job_id = None
+    elif active_job.finished:
+        render_finished_job(active_job)
+    else:
+        render_job_progress(active_job.id)
+    
+    # 我的任务：刷新页面或关闭后重新打开，仍可查看和载入后台任务的结果
+    my_jobs = get_job_manager().jobs_for(st.session_state.get('username', 'anonymous'))
+    if my_jobs:
+        with st.expander(f"📋 我的任务（{len(my_jobs)}）"):
+            for job in my_jobs:
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    st.markdown(
+                        f"**{job.title}** · {JOB_STATUS_LABELS[job.status]} · "
+                        f"{pd.Timestamp.fromtimestamp(job.created_at).strftime('%H:%M:%S')} 提交 · "
+                        f"{job.done_rows}/{job.total_rows} 条"
+                    )
+                with col2:
+                    if job.status == JOB_DONE:
+                        if st.button("载入结果", key=f"load_{job.id}", use_container_width=True):
+                            load_job_result(job)
+                            st.session_state.active_job_id = job.id
+                            st.rerun()
+                    elif not job.finished and job.id != st.session_state.get('active_job_id'):
+                        if st.button("查看进度", key=f"watch_{job.id}", use_container_width=True):
+                            st.session_state.active_job_id = job.id
+                            st.rerun()
+    
     # 结果展示和下载
     if st.session_state.annotated_df is not None:
         st.markdown('<div class="section-header">📊 标注结果</div>', unsafe_allow_html=True)
@@ -1111,21 +1458,20 @@ def main():
         annotated_df = st.session_state.annotated_df
         
         # 结果统计
-        annotation_col = [col for col in annotated_df.columns if "标注" in col or "AI_" in col]
+        annotation_col = st.session_state.get('annotation_column')
+        if annotation_col not in annotated_df.columns:
+            candidates = [col for col in annotated_df.columns if "标注" in col or "AI_" in col]
+            annotation_col = candidates[0] if candidates else None
         if annotation_col:
-            annotation_col = annotation_col[0]
             
             col1, col2 = st.columns([2, 1])
             
-            with col1:
-                st.markdown("**标注结果预览：**")
-                st.dataframe(annotated_df, use_container_width=True)
-            
-            with col2:
-                st.markdown("**标注分布：**")
-                annotation_counts = annotated_df[annotation_col].value_counts()
+            # 标注分布和饼图在同一份标注结果上只计算一次
+            result_cache = st.session_state.setdefault('result_cache', {})
+            if ('counts', annotation_col) not in result_cache:
+                import plotly.express as px
                 
-                # 饼图
+                annotation_counts = annotated_df[annotation_col].value_counts()
                 fig = px.pie(
                     values=annotation_counts.values,
                     names=annotation_counts.index,
@@ -1136,6 +1482,32 @@ def main():
                     margin=dict(l=20, r=20, t=40, b=20),
                     legend=dict(orientation="h", y=-0.2)
                 )
+                result_cache[('counts', annotation_col)] = (annotation_counts, fig)
+            annotation_counts, fig = result_cache[('counts', annotation_col)]
+            
+            with col1:
+                st.markdown("**标注结果预览：**")
+                
+                # 按标注结果筛选，筛选在服务端完成，同一组条件只计算一次
+                selected_labels = st.multiselect(
+                    "按标注结果筛选",
+                    options=annotation_counts.index.tolist(),
+                    key="result_label_filter",
+                    help="不选择时显示全部结果"
+                )
+                positions = None
+                if selected_labels:
+                    filter_key = ('filter', annotation_col, tuple(selected_labels))
+                    if filter_key not in result_cache:
+                        result_cache[filter_key] = np.flatnonzero(
+                            annotated_df[annotation_col].isin(selected_labels).to_numpy()
+                        )
+                    positions = result_cache[filter_key]
+                
+                render_paginated_dataframe(annotated_df, "result", positions)
+            
+            with col2:
+                st.markdown("**标注分布：**")
                 st.plotly_chart(fig, use_container_width=True)
                 
                 # 统计表
@@ -1144,44 +1516,29 @@ def main():
         # 下载按钮
         st.markdown('<div class="section-header">📥 下载结果</div>', unsafe_allow_html=True)
         
-        col1, col2, col3 = st.columns([1, 1, 1])
-        
-        with col1:
-            # CSV下载
-            csv = annotated_df.to_csv(index=False, encoding='utf-8-sig')
-            st.download_button(
-                label="📄 下载CSV文件",
-                data=csv,
-                file_name=f"标注结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv",
-                use_container_width=True
-            )
+        # 只生成所选格式，同一份标注结果的导出内容只生成一次
+        export_format = st.radio(
+            "选择导出格式",
+            options=list(EXPORT_FORMATS.keys()),
+            horizontal=True
+        )
+        extension, mime = EXPORT_FORMATS[export_format]
         
-        with col2:
-            # Excel下载
-            excel_buffer = io.BytesIO()
-            with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                annotated_df.to_excel(writer, index=False, sheet_name='标注结果')
-            excel_data = excel_buffer.getvalue()
-            
-            st.download_button(
-                label="📊 下载Excel文件",
-                data=excel_data,
-                file_name=f"标注结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
-            )
+        export_cache = st.session_state.setdefault('export_cache', {})
+        if export_format not in export_cache:
+            with st.spinner(f"正在生成{export_format}文件..."):
+                export_cache[export_format] = export_dataframe(
+                    annotated_df, extension,
+                    categorical_columns=[annotation_col] if annotation_col else []
+                )
         
-        with col3:
-            # JSON下载
-            json_data = annotated_df.to_json(orient='records', force_ascii=False, indent=2)
-            st.download_button(
-                label="🔧 下载JSON文件",
-                data=json_data,
-                file_name=f"标注结果_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.json",
-                mime="application/json",
-                use_container_width=True
-            )
+        st.download_button(
+            label=f"📥 下载{export_format}文件",
+            data=export_cache[export_format],
+            file_name=f"标注结果_{st.session_state.get('annotated_at', pd.Timestamp.now()).strftime('%Y%m%d_%H%M%S')}.{extension}",
+            mime=mime,
+            use_container_width=True
+        )
 
     # 帮助信息
     st.markdown('<div class="section-header">📖 使用帮助</div>', unsafe_allow_html=True)
@@ -1193,7 +1550,7 @@ def main():
         2. **测试连接**：点击"测试API连接"验证配置并获取可用模型
         3. **选择模型**：从下拉列表中选择适合的AI模型
         4. **测试标注**：点击"测试标注功能"验证模型工作正常
-        5. **上传文件**：支持CSV、XLSX、XLS格式
+        5. **上传文件**：支持CSV、XLSX、XLS、Parquet、Feather格式
         6. **预览数据**：查看文件内容和数据信息
         7. **选择列**：选择需要进行AI标注的列（可多选）
         8. **配置标注**：
@@ -1203,7 +1560,7 @@ def main():
         9. **调整参数**：在高级设置中调整创造性程度和输出长度
         10. **执行标注**：点击开始按钮，AI将自动处理数据
         11. **查看结果**：查看标注分布和统计信息
-        12. **下载文件**：支持CSV、Excel、JSON格式下载
+        12. **下载文件**：支持CSV、Excel、JSON、Parquet、Feather格式下载
         
         ### 🔧 API配置示例
         
@@ -1226,7 +1583,8 @@ def main():
           - **GPT-3.5**: 速度快，经济实用
           - **Gemini**: 中文友好，**推荐使用**
         - **连接测试**：每次更换API配置后建议重新测试连接
-        - **批次大小**：数据量大时建议减小批次大小，提高稳定性
+        - **批次大小**：默认按Token自适应分批，短文本自动合并成大批次；关闭后使用固定批次大小，数据量大时建议减小批次大小，提高稳定性
+        - **并发请求数**：提高并发可显著缩短大文件处理时间，遇到限流报错时适当调低
         - **标注要求**：越详细的要求，AI标注效果越好
         - **选项设计**：包含"其他"选项处理边界情况
         - **参数调整**：降低创造性程度可提高一致性，增加可提高灵活性
@@ -1236,7 +1594,8 @@ def main():
         - 确保网络连接稳定
         - 大文件处理可能需要较长时间
         - API调用可能产生费用，请注意用量控制
-        - 系统会自动尝试结构化输出以提高准确性
+        - 系统会自动尝试结构化输出以提高准确性，并记住不支持结构化输出的模型，之后直接使用JSON模式
+        - 整批标注失败时会自动拆分批次重试，只有单条仍无法标注的数据才会标记为"标注失败"
         - 所有API都已优化安全设置，自动处理兼容性
         """)
 
@@ -0,0 +1,134 @@
+import json
+import math
+from typing import List
+
+from prompt_formats import PROMPT_FORMAT_COMPACT, PROMPT_FORMAT_JSON, PROMPT_FORMAT_LOGPROB
+from token_estimator import estimate_tokens
+
+# 常见模型的上下文长度（按模型名前缀匹配，取最长的匹配项）
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-35-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+    "claude": 200000,
+    "gemini": 1048576,
+    "gemini-1.0": 32768,
+    "deepseek": 65536,
+    "qwen": 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# 提示词模板中固定说明文字的token数（不含标注要求、选项和数据）
+PROMPT_TEMPLATE_TOKENS = 300
+
+# 单字母分类逐条请求，批次只是调度和断点的单位，取较小值让多个批次并发
+LOGPROB_BATCH_SIZE = 5
+
+# 预留的安全余量，抵消token估算误差
+CONTEXT_SAFETY_RATIO = 0.8
+OUTPUT_SAFETY_RATIO = 0.8
+
+
+def get_context_window(model: str) -> int:
+    """获取模型的上下文长度，未知模型使用保守的默认值"""
+    model = (model or "").lower()
+    matches = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_CONTEXT_WINDOW
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+
+
+def reserved_output_tokens(model: str, max_tokens: int) -> int:
+    """每次请求为输出预留的token数：max_tokens，但不超过上下文预算的一半，保证输入至少有一半的空间"""
+    return max(1, min(max_tokens, int(get_context_window(model) * CONTEXT_SAFETY_RATIO) // 2))
+
+
+def fit_max_tokens(model: str, max_tokens: int, input_tokens: int) -> int:
+    """把单次请求的 max_tokens 降到上下文长度减去预计输入（含估算余量）后剩余的部分
+
+    接口按 输入 + max_tokens 检查上下文长度，超出时直接拒绝请求。
+    """
+    available = get_context_window(model) - math.ceil(input_tokens / CONTEXT_SAFETY_RATIO)
+    return max(1, min(max_tokens, available))
+
+
+def estimate_row_tokens(text: str, prompt_format: str = PROMPT_FORMAT_JSON) -> int:
+    """估算单条数据在提示词中占用的token数（JSON格式含引号、缩进和换行，紧凑格式含行号）"""
+    if prompt_format == PROMPT_FORMAT_COMPACT:
+        return estimate_tokens(text) + 2
+    return estimate_tokens(json.dumps(text, ensure_ascii=False)) + 2
+
+
+def estimate_label_tokens(annotation_options: List[str], prompt_format: str = PROMPT_FORMAT_JSON) -> int:
+    """估算单条标注结果在输出中占用的token数（JSON格式按最长的选项计，紧凑格式为编号加逗号）"""
+    if prompt_format == PROMPT_FORMAT_COMPACT:
+        return estimate_tokens(str(len(annotation_options))) + 1
+    longest = max((estimate_tokens(json.dumps(option, ensure_ascii=False)) for option in annotation_options), default=4)
+    return longest + 2
+
+
+def fixed_batch_sizes(total_rows: int, batch_size: int) -> List[int]:
+    """按固定条数等分，返回每批的条数（最后一批可能不足 batch_size）"""
+    batch_size = max(1, batch_size)
+    return [min(batch_size, total_rows - i) for i in range(0, total_rows, batch_size)]
+
+
+def plan_batch_sizes(data: List[str], max_batch_size: int, annotation_requirements: str,
+                     annotation_options: List[str], model: str, max_tokens: int,
+                     prompt_format: str = PROMPT_FORMAT_JSON) -> List[int]:
+    """按token预算切分批次，返回每批的条数
+
+    依次装入数据，直到再装一条会超过以下任一限制：
+    - 提示词超过模型上下文长度减去为输出预留的token（见 reserved_output_tokens）
+    - 预计输出超过预留的输出长度
+    - 条数达到 max_batch_size
+    短文本得到较大的批次，长文本得到较小的批次，每批至少一条。
+    prompt_format 为紧凑格式时每条数据和结果占用更少的token，同样的预算能装入更多数据；
+    为单字母分类时每条数据单独请求，按 LOGPROB_BATCH_SIZE 等分。
+    """
+    if prompt_format == PROMPT_FORMAT_LOGPROB:
+        return fixed_batch_sizes(len(data), min(max_batch_size, LOGPROB_BATCH_SIZE))
+
+    # 接口按 输入 + max_tokens 检查上下文长度，输入只能使用预留输出之外的部分
+    reserved_output = reserved_output_tokens(model, max_tokens)
+    input_budget = get_context_window(model) * CONTEXT_SAFETY_RATIO - reserved_output
+    output_budget = reserved_output * OUTPUT_SAFETY_RATIO
+    overhead = (
+        PROMPT_TEMPLATE_TOKENS
+        + estimate_tokens(annotation_requirements)
+        + estimate_tokens(", ".join(annotation_options))
+    )
+    label_tokens = estimate_label_tokens(annotation_options, prompt_format)
+
+    batch_sizes: List[int] = []
+    count = 0
+    input_tokens = overhead
+    output_tokens = 0
+    for text in data:
+        row_tokens = estimate_row_tokens(text, prompt_format)
+        fits = (
+            count < max_batch_size
+            and input_tokens + row_tokens <= input_budget
+            and output_tokens + label_tokens <= output_budget
+        )
+        if count and not fits:
+            batch_sizes.append(count)
+            count = 0
+            input_tokens = overhead
+            output_tokens = 0
+        count += 1
+        input_tokens += row_tokens
+        output_tokens += label_tokens
+
+    if count:
+        batch_sizes.append(count)
+    return batch_sizes
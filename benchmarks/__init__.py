@@ -0,0 +1 @@
+"""离线性能基准：本地模拟OpenAI兼容接口，测量标注流水线的吞吐、延迟和内存"""
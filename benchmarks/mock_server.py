@@ -0,0 +1,272 @@
+"""本地模拟的OpenAI兼容接口
+
+实现 /v1/models 和 /v1/chat/completions（含 response_format 结构化输出、logprobs），
+可配置延迟、错误率、429限流率和响应截断率，用于离线测量标注流水线，不产生任何费用。
+
+单独运行：
+    python -m benchmarks.mock_server --port 18080 --latency-ms 200 --rate-limit-rate 0.05
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from prompt_formats import LOGPROB_OPTION_CODES
+from token_estimator import estimate_tokens
+
+MOCK_MODELS = ["gpt-4o-mini", "gpt-4o", "gemini-2.5-flash"]
+
+_ROW_COUNT = re.compile(r"^数据（共 \d+ (条|行)）：\n")
+_NUMBERED_ROW = re.compile(r"^\d+\. ")
+
+
+def parse_options(system: str) -> List[str]:
+    """从系统消息中解析标注选项（逗号分隔、编号或字母三种写法）"""
+    for line_prefix in ("可选标注选项（编号=选项）：\n", "可选标注选项（字母=选项）：\n"):
+        if line_prefix in system:
+            block = system.split(line_prefix, 1)[1].split("\n\n", 1)[0]
+            return [line.split("=", 1)[1] for line in block.split("\n") if "=" in line]
+    match = re.search(r"可选标注选项：(.*)", system)
+    return match.group(1).split(", ") if match else ["正面", "负面", "中性"]
+
+
+def parse_rows(user: str) -> Tuple[str, List[str]]:
+    """从用户消息中解析本批数据，返回 (格式, 数据)"""
+    match = _ROW_COUNT.match(user)
+    if match and match.group(1) == "行":
+        body = user[match.end():]
+        return "compact", [_NUMBERED_ROW.sub("", line, count=1) for line in body.split("\n")]
+    if match:
+        return "json", json.loads(user[match.end():])
+    return "logprob", [user[len("数据："):] if user.startswith("数据：") else user]
+
+
+def pick_label(text: str, count: int) -> int:
+    """按文本内容确定性地选择选项下标，相同文本总是得到相同结果"""
+    return zlib.crc32(text.encode("utf-8")) % count
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """请求处理"""
+
+    server: "MockOpenAIServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send(200, {
+                "object": "list",
+                "data": [{"id": model, "object": "model", "created": 0, "owned_by": "mock"} for model in MOCK_MODELS]
+            })
+        else:
+            self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+
+        config = self.server
+        time.sleep(config.next_latency())
+
+        fault = config.next_fault()
+        if fault == "rate_limit":
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                       headers={"retry-after-ms": str(config.retry_after_ms)})
+            return
+        if fault == "error":
+            self._send(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+            return
+        if body.get("response_format") and not config.structured:
+            self._send(400, {"error": {"message": "response_format is not supported", "type": "invalid_request_error"}})
+            return
+        if body.get("logprobs") and not config.logprobs:
+            self._send(400, {"error": {"message": "logprobs is not supported with this model", "type": "invalid_request_error"}})
+            return
+
+        self._send(200, config.complete(body, truncated=fault == "truncate"))
+
+    def _send(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """模拟的OpenAI兼容服务器，在后台线程中运行"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 20.0,
+                 jitter_ms: float = 10.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 truncation_rate: float = 0.0, structured: bool = True, retry_after_ms: int = 50,
+                 seed: int = 0, logprobs: bool = True):
+        """初始化服务器
+
+        latency_ms / jitter_ms 为每个请求的基础延迟和随机抖动；error_rate、rate_limit_rate、
+        truncation_rate 分别为返回500、429和截断响应（finish_reason=length）的概率；
+        structured 为 False 时拒绝 response_format 请求，模拟不支持结构化输出的服务；
+        logprobs 为 False 时拒绝 logprobs 请求，模拟不支持单字母分类的服务。
+        """
+        super().__init__((host, port), _Handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.truncation_rate = truncation_rate
+        self.structured = structured
+        self.logprobs = logprobs
+        self.retry_after_ms = retry_after_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._seen_prefixes = set()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "truncated": 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        """在后台线程中启动"""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """停止服务器"""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def next_latency(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency_ms + self._random.uniform(0, self.jitter_ms)) / 1000
+
+    def next_fault(self) -> Optional[str]:
+        """按配置的概率抽取本次请求的故障类型"""
+        with self._lock:
+            self.stats["requests"] += 1
+            roll = self._random.random()
+            for fault, rate, counter in (
+                ("rate_limit", self.rate_limit_rate, "rate_limited"),
+                ("error", self.error_rate, "errors"),
+                ("truncate", self.truncation_rate, "truncated"),
+            ):
+                if roll < rate:
+                    self.stats[counter] += 1
+                    return fault
+                roll -= rate
+            return None
+
+    def complete(self, body: Dict, truncated: bool = False) -> Dict:
+        """生成补全响应"""
+        messages = body.get("messages", [])
+        system = messages[0]["content"] if len(messages) > 1 else ""
+        user = messages[-1]["content"] if messages else ""
+        options = parse_options(system)
+        prompt_format, rows = parse_rows(user)
+        indices = [pick_label(text, len(options)) for text in rows]
+
+        logprobs = None
+        if body.get("logprobs"):
+            code = LOGPROB_OPTION_CODES[indices[0]]
+            confidence = 0.5 + (zlib.crc32(rows[0].encode("utf-8")) % 50) / 100
+            alternative = LOGPROB_OPTION_CODES[(indices[0] + 1) % len(options)]
+            content = code
+            logprobs = {"content": [{
+                "token": code, "logprob": _log(confidence), "bytes": None,
+                "top_logprobs": [
+                    {"token": code, "logprob": _log(confidence), "bytes": None},
+                    {"token": alternative, "logprob": _log(1 - confidence), "bytes": None},
+                ]
+            }]}
+        elif prompt_format == "compact":
+            content = ",".join(str(index + 1) for index in indices)
+        else:
+            content = json.dumps({"annotations": [options[index] for index in indices]}, ensure_ascii=False)
+
+        if truncated:
+            content = content[:max(1, len(content) // 2)]
+
+        # 同一前缀第二次出现起计为命中提示词缓存
+        with self._lock:
+            cached = system in self._seen_prefixes
+            self._seen_prefixes.add(system)
+        prompt_tokens = estimate_tokens(system) + estimate_tokens(user)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", MOCK_MODELS[0]),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "length" if truncated else "stop",
+                "message": {"role": "assistant", "content": content},
+                "logprobs": logprobs,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": estimate_tokens(content),
+                "total_tokens": prompt_tokens + estimate_tokens(content),
+                "prompt_tokens_details": {"cached_tokens": estimate_tokens(system) if cached else 0},
+            },
+        }
+
+
+def _log(probability: float) -> float:
+    return math.log(max(probability, 1e-9))
+
+
+def main() -> None:
+    """命令行入口：在前台运行模拟服务器"""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.mock_server", description="本地模拟的OpenAI兼容接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="每个请求的基础延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="随机抖动（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--truncation-rate", type=float, default=0.0, help="返回截断响应的概率")
+    parser.add_argument("--no-structured", action="store_true", help="拒绝 response_format 请求")
+    parser.add_argument("--no-logprobs", action="store_true", help="拒绝 logprobs 请求")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        truncation_rate=args.truncation_rate, structured=not args.no_structured,
+        logprobs=not args.no_logprobs
+    )
+    print(f"模拟接口已启动：{server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""离线性能基准
+
+启动本地模拟接口，对示例数据和合成的大数据集跑完整的标注流水线
+（读取、拼接、去重、切分批次、并发请求、限流重试），
+报告吞吐（行/秒）、批次延迟 p50/p99 和峰值内存。每个数据集在独立子进程中运行，峰值内存互不影响。
+
+示例：
+    python -m benchmarks.run
+    python -m benchmarks.run --datasets synthetic --synthetic-rows 100000 --latency-ms 200 --rate-limit-rate 0.05
+    python -m benchmarks.run --prompt-format compact --json bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from annotation_cache import AnnotationCache
+from annotator import AIAnnotator, annotate_concurrently
+from batching import plan_batch_sizes
+from benchmarks.mock_server import MockOpenAIServer
+from capability_registry import CapabilityRegistry
+from client_registry import ClientRegistry
+from prompt_formats import PROMPT_FORMAT_JSON, PROMPT_FORMATS
+from rate_limiter import RateLimiter
+from row_texts import build_row_texts, deduplicate_rows
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 示例数据集：名称 -> (文件, 标注列)
+DATASETS = {
+    "sample": ("sample_data.csv", ["评论内容"]),
+    "ecommerce": ("ecommerce_reviews.csv", ["评论内容"]),
+    "user_reviews": ("user_reviews_sample.csv", ["评论内容"]),
+}
+
+REQUIREMENTS = "判断用户对产品的情感态度"
+OPTIONS = ["正面", "负面", "中性"]
+
+_SYNTHETIC_TEMPLATES = [
+    "这款产品质量很好，物流也快，会回购",
+    "用了两天就坏了，客服也不理人，非常失望",
+    "一般般吧，和描述差不多，没什么特别的",
+    "包装有点简陋，不过东西还行，性价比可以",
+    "颜色和图片不一样，尺码偏小，退货流程太麻烦了",
+    "第二次购买了，家里人都很喜欢，推荐",
+    "价格有点贵，但是做工确实精细，整体满意",
+    "发货太慢了，等了一个多星期才到",
+]
+
+
+def make_synthetic_frame(rows: int, distinct_ratio: float = 0.3, seed: int = 0) -> pd.DataFrame:
+    """生成合成评论数据，约 distinct_ratio 比例的行内容互不相同，其余为重复内容"""
+    rng = np.random.default_rng(seed)
+    distinct = max(1, int(rows * distinct_ratio))
+    ids = rng.integers(0, distinct, size=rows)
+    templates = np.array(_SYNTHETIC_TEMPLATES, dtype=object)[ids % len(_SYNTHETIC_TEMPLATES)]
+    return pd.DataFrame({
+        "评论ID": np.arange(1, rows + 1),
+        "评论内容": pd.Series(templates) + "（订单" + pd.Series(ids).astype(str) + "）",
+        "评分": rng.integers(1, 6, size=rows),
+    })
+
+
+def load_dataset(name: str, synthetic_rows: int) -> tuple:
+    """读取数据集，返回 (数据, 标注列)"""
+    if name == "synthetic":
+        return make_synthetic_frame(synthetic_rows), ["评论内容"]
+    filename, columns = DATASETS[name]
+    # sample_data.csv 末尾附带一段说明文字，按坏行跳过
+    return pd.read_csv(os.path.join(ROOT, filename), on_bad_lines="skip"), columns
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class TimedAnnotator(AIAnnotator):
+    """记录每批请求耗时的标注器"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_latencies: List[float] = []
+        self._latency_lock = threading.Lock()
+
+    def annotate_batch(self, data: List[str], *args, **kwargs) -> List[str]:
+        started = time.perf_counter()
+        try:
+            return super().annotate_batch(data, *args, **kwargs)
+        finally:
+            with self._latency_lock:
+                self.batch_latencies.append(time.perf_counter() - started)
+
+
+def run_scenario(name: str, config: Dict) -> Dict:
+    """在当前进程中跑一个数据集，返回测量结果"""
+    timings = {}
+    started = time.perf_counter()
+    df, columns = load_dataset(name, config["synthetic_rows"])
+    timings["load_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    data = build_row_texts(df, columns)
+    unique_data, inverse = deduplicate_rows(data)
+    timings["prepare_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch_sizes = plan_batch_sizes(
+        unique_data, config["batch_size"], REQUIREMENTS, OPTIONS,
+        config["model"], config["max_tokens"], config["prompt_format"]
+    )
+    timings["plan_seconds"] = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rate_limiter = RateLimiter(
+            max_concurrency=config["max_workers"],
+            max_retries=config["max_retries"],
+            backoff_base=config["backoff_base"]
+        )
+        annotator = TimedAnnotator(
+            "mock-key", config["base_url"],
+            cache=AnnotationCache(path=os.path.join(tmp, "cache.sqlite3")) if config["with_cache"] else None,
+            capabilities=CapabilityRegistry(path=os.path.join(tmp, "capabilities.json")),
+            rate_limiter=rate_limiter,
+            clients=ClientRegistry(),
+            prompt_format=config["prompt_format"]
+        )
+
+        started = time.perf_counter()
+        unique_annotations = annotate_concurrently(
+            annotator, unique_data, config["batch_size"], REQUIREMENTS, OPTIONS,
+            model=config["model"], max_tokens=config["max_tokens"],
+            max_workers=config["max_workers"], batch_sizes=batch_sizes
+        )
+        timings["annotate_seconds"] = time.perf_counter() - started
+        annotations = [unique_annotations[i] for i in inverse]
+
+    latencies = np.array(annotator.batch_latencies or [0.0]) * 1000
+    total_seconds = sum(timings.values())
+    return {
+        "dataset": name,
+        "rows": len(data),
+        "unique_rows": len(unique_data),
+        "batches": len(batch_sizes),
+        "failed_rows": sum(1 for label in annotations if label == "标注失败"),
+        **{key: round(value, 3) for key, value in timings.items()},
+        "rows_per_second": round(len(data) / total_seconds, 1) if total_seconds else 0.0,
+        "batch_p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "batch_p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "retries": rate_limiter.retries,
+        "prompt_tokens": annotator.prompt_tokens,
+        "cached_tokens": annotator.cached_tokens,
+        "completion_tokens": annotator.completion_tokens,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def _scenario_worker(name: str, config: Dict, queue) -> None:
+    try:
+        queue.put(run_scenario(name, config))
+    except Exception as e:
+        queue.put({"dataset": name, "error": f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(name: str, config: Dict) -> Dict:
+    """在独立子进程中跑一个数据集，峰值内存只统计该数据集"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_scenario_worker, args=(name, config, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def format_result(result: Dict) -> str:
+    """格式化单个数据集的结果"""
+    if "error" in result:
+        return f"{result['dataset']}: 失败 - {result['error']}"
+    return (
+        f"{result['dataset']}: {result['rows']} 行（去重后 {result['unique_rows']} 行，{result['batches']} 批）\n"
+        f"  吞吐 {result['rows_per_second']} 行/秒，批次延迟 p50 {result['batch_p50_ms']} ms / "
+        f"p99 {result['batch_p99_ms']} ms，峰值内存 {result['peak_rss_mb']} MB\n"
+        f"  读取 {result['load_seconds']}s，拼接去重 {result['prepare_seconds']}s，"
+        f"切分批次 {result['plan_seconds']}s，标注 {result['annotate_seconds']}s\n"
+        f"  重试 {result['retries']} 次，失败 {result['failed_rows']} 行，"
+        f"token 输入 {result['prompt_tokens']}（缓存命中 {result['cached_tokens']}）/ 输出 {result['completion_tokens']}"
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="标注流水线离线性能基准")
+    parser.add_argument("--datasets", default="sample,ecommerce,user_reviews,synthetic",
+                        help="逗号分隔的数据集：sample / ecommerce / user_reviews / synthetic")
+    parser.add_argument("--synthetic-rows", type=int, default=1_000_000, help="合成数据集的行数")
+    parser.add_argument("--model", default="gpt-4o-mini", help="请求中使用的模型名（影响批次的上下文预算）")
+    parser.add_argument("--prompt-format", choices=list(PROMPT_FORMATS), default=PROMPT_FORMAT_JSON, help="提示词格式")
+    parser.add_argument("--batch-size", type=int, default=50, help="每批最多条数")
+    parser.add_argument("--max-tokens", type=int, default=2000, help="最大输出token数")
+    parser.add_argument("--max-workers", type=int, default=8, help="最多同时在途的请求数")
+    parser.add_argument("--max-retries", type=int, default=5, help="429/5xx最多重试次数")
+    parser.add_argument("--backoff-base", type=float, default=0.05, help="重试退避的基础等待秒数")
+    parser.add_argument("--with-cache", action="store_true", help="启用标注缓存（临时目录，每个数据集重新开始）")
+    server = parser.add_argument_group("模拟接口")
+    server.add_argument("--latency-ms", type=float, default=20.0, help="每个请求的基础延迟（毫秒）")
+    server.add_argument("--jitter-ms", type=float, default=10.0, help="随机抖动（毫秒）")
+    server.add_argument("--error-rate", type=float, default=0.0, help="返回500的概率")
+    server.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的概率")
+    server.add_argument("--truncation-rate", type=float, default=0.0, help="返回截断响应的概率")
+    server.add_argument("--no-structured", action="store_true", help="模拟不支持结构化输出的服务")
+    server.add_argument("--no-logprobs", action="store_true", help="模拟不支持logprobs的服务")
+    parser.add_argument("--json", dest="json_output", help="把结果另存为JSON文件")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    names = [name.strip() for name in args.datasets.split(",") if name.strip()]
+    unknown = [name for name in names if name != "synthetic" and name not in DATASETS]
+    if unknown:
+        print(f"未知的数据集：{', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    with MockOpenAIServer(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, truncation_rate=args.truncation_rate,
+        structured=not args.no_structured, logprobs=not args.no_logprobs
+    ) as server:
+        config = {
+            "base_url": server.base_url,
+            "synthetic_rows": args.synthetic_rows,
+            "model": args.model,
+            "prompt_format": args.prompt_format,
+            "batch_size": args.batch_size,
+            "max_tokens": args.max_tokens,
+            "max_workers": args.max_workers,
+            "max_retries": args.max_retries,
+            "backoff_base": args.backoff_base,
+            "with_cache": args.with_cache,
+        }
+        results = []
+        for name in names:
+            before = dict(server.stats)
+            result = run_isolated(name, config)
+            result["server"] = {key: server.stats[key] - before[key] for key in before}
+            results.append(result)
+            print(format_result(result))
+            print(f"  模拟接口：{result['server']['requests']} 个请求，429 {result['server']['rate_limited']} 次，"
+                  f"500 {result['server']['errors']} 次，截断 {result['server']['truncated']} 次", flush=True)
+
+    if args.json_output:
+        with open(args.json_output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    return 1 if any("error" in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""网页版启动与重新运行耗时基准
+
+每项测量都在新的子进程中进行，模拟容器刚启动时的冷启动：
+- 各重量级依赖在 streamlit、pandas 之后的增量导入耗时
+- 用 Streamlit AppTest 运行 app.py：首次运行（冷启动）耗时、之后每次重新运行的平均耗时，
+  以及首次运行后是否已经加载了 openai、plotly 等模块
+
+示例：
+    python -m benchmarks.startup
+    python -m benchmarks.startup --reruns 20 --json startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["openai", "plotly.express", "st_aggrid", "annotator"]
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+import streamlit, pandas
+started = time.perf_counter()
+try:
+    __import__(sys.argv[1])
+    print(json.dumps({"seconds": time.perf_counter() - started}))
+except ImportError as e:
+    print(json.dumps({"error": str(e)}))
+"""
+
+_APP_SCRIPT = """
+import json, sys, time
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+app_path, page, reruns = sys.argv[1], sys.argv[2], int(sys.argv[3])
+at = AppTest.from_file(app_path, default_timeout=120)
+if page == "main":
+    at.session_state["authenticated"] = True
+    at.session_state["username"] = "admin"
+    at.session_state["df"] = pd.read_csv(sys.argv[4])
+    at.session_state["selected_columns"] = ["评论内容"]
+
+started = time.perf_counter()
+at.run()
+first = time.perf_counter() - started
+
+timings = []
+for _ in range(reruns):
+    started = time.perf_counter()
+    at.run()
+    timings.append(time.perf_counter() - started)
+
+print(json.dumps({
+    "first_run_seconds": first,
+    "rerun_seconds": sum(timings) / len(timings) if timings else None,
+    "exceptions": [str(e.value) for e in at.exception],
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def _run_python(script: str, *args: str) -> Dict:
+    env = {**os.environ, "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    completed = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        capture_output=True, text=True, cwd=ROOT, env=env, timeout=600
+    )
+    lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+    if not lines:
+        return {"error": (completed.stderr.strip().splitlines() or ["无输出"])[-1]}
+    return json.loads(lines[-1])
+
+
+def measure_imports(modules: List[str], repeat: int) -> Dict[str, Dict]:
+    """在新进程中测量每个模块的增量导入耗时，取多次中的最小值"""
+    results = {}
+    for module in modules:
+        samples = [_run_python(_IMPORT_SCRIPT, module) for _ in range(repeat)]
+        errors = [sample["error"] for sample in samples if "error" in sample]
+        results[module] = (
+            {"error": errors[0]} if errors
+            else {"seconds": min(sample["seconds"] for sample in samples)}
+        )
+    return results
+
+
+def measure_app(page: str, reruns: int, data_path: str) -> Dict:
+    """在新进程中运行 app.py，测量首次运行和重新运行的耗时"""
+    return _run_python(_APP_SCRIPT, os.path.join(ROOT, "app.py"), page, str(reruns), data_path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup", description="网页版启动与重新运行耗时基准")
+    parser.add_argument("--reruns", type=int, default=10, help="每个页面重新运行的次数")
+    parser.add_argument("--repeat", type=int, default=3, help="每个模块导入测量的次数（取最小值）")
+    parser.add_argument("--data", default=os.path.join(ROOT, "ecommerce_reviews.csv"), help="主页面载入的数据文件")
+    parser.add_argument("--json", dest="json_output", help="把结果另存为JSON文件")
+    args = parser.parse_args(argv)
+
+    imports = measure_imports(HEAVY_MODULES, args.repeat)
+    print("增量导入耗时（已导入 streamlit、pandas）：")
+    for module, result in imports.items():
+        print(f"  {module}: " + (f"{result['seconds'] * 1000:.0f} ms" if "seconds" in result else f"无法导入（{result['error']}）"))
+
+    pages = {}
+    for page, title in (("login", "登录页"), ("main", "主页面（已登录并载入数据）")):
+        result = pages[page] = measure_app(page, args.reruns, args.data)
+        if "error" in result:
+            print(f"{title}：运行失败 - {result['error']}")
+            continue
+        print(
+            f"{title}：首次运行 {result['first_run_seconds'] * 1000:.0f} ms，"
+            f"重新运行平均 {result['rerun_seconds'] * 1000:.0f} ms，"
+            f"已加载 {', '.join(result['loaded']) or '无'}"
+        )
+        for message in result["exceptions"]:
+            print(f"  异常：{message}")
+
+    if args.json_output:
+        with open(args.json_output, "w", encoding="utf-8") as f:
+            json.dump({"imports": imports, "pages": pages}, f, ensure_ascii=False, indent=2)
+    return 1 if any("error" in result or result.get("exceptions") for result in pages.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# 默认保存位置：docker-compose 中挂载的 ./data 目录
+DEFAULT_REGISTRY_PATH = os.path.join(os.getenv("DATA_DIR", "data"), "model_capabilities.json")
+
+
+class CapabilityRegistry:
+    """模型输出能力登记表
+
+    按 (base_url, 模型) 记录结构化输出（response_format）和logprobs是否可用，
+    已知不支持的组合直接走JSON回退模式或紧凑格式，避免每批多付一次失败请求。
+    """
+
+    def __init__(self, path: str = DEFAULT_REGISTRY_PATH):
+        """初始化登记表并读取已保存的记录"""
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._entries = {}
+
+    @staticmethod
+    def _key(base_url: str, model: str) -> str:
+        return f"{(base_url or '').rstrip('/')}|{model}"
+
+    def _supports(self, base_url: str, model: str, capability: str) -> Optional[bool]:
+        with self._lock:
+            entry = self._entries.get(self._key(base_url, model))
+            return entry.get(capability) if entry else None
+
+    def _record(self, base_url: str, model: str, capability: str, supported: bool) -> None:
+        key = self._key(base_url, model)
+        with self._lock:
+            entry = self._entries.get(key) or {}
+            if entry.get(capability) == supported:
+                return
+            self._entries[key] = {**entry, capability: supported, "updated_at": time.time()}
+            self._save()
+
+    def supports_structured(self, base_url: str, model: str) -> Optional[bool]:
+        """查询结构化输出是否可用，未知时返回 None"""
+        return self._supports(base_url, model, "structured")
+
+    def record_structured(self, base_url: str, model: str, supported: bool) -> None:
+        """记录结构化输出是否可用，结果变化时写入文件"""
+        self._record(base_url, model, "structured", supported)
+
+    def supports_logprobs(self, base_url: str, model: str) -> Optional[bool]:
+        """查询单字母分类所需的logprobs（及 max_tokens=1）是否可用，未知时返回 None"""
+        return self._supports(base_url, model, "logprobs")
+
+    def record_logprobs(self, base_url: str, model: str, supported: bool) -> None:
+        """记录logprobs是否可用，结果变化时写入文件"""
+        self._record(base_url, model, "logprobs", supported)
+
+    def forget(self, base_url: str, model: str) -> None:
+        """删除记录，下次请求时重新探测"""
+        with self._lock:
+            if self._entries.pop(self._key(base_url, model), None) is not None:
+                self._save()
+
+    def _save(self) -> None:
+        """原子写入文件（调用方需持有锁）"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,329 @@
+"""AI Excel 智能标注 - 命令行批量标注
+
+示例：
+    python -m cli annotate input.xlsx --columns 评论内容 \\
+        --requirements "判断用户对产品的情感态度" --options-file labels.txt \\
+        --model gpt-4o-mini --output output.csv
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from annotation_cache import AnnotationCache
+from annotator import AIAnnotator, annotate_concurrently
+from batching import fixed_batch_sizes, plan_batch_sizes
+from capability_registry import CapabilityRegistry
+from client_registry import ClientRegistry
+from file_io import ChunkWriter, iter_table_chunks
+from metrics import RunMetrics
+from prompt_formats import PROMPT_FORMAT_COMPACT, PROMPT_FORMAT_JSON, PROMPT_FORMAT_LOGPROB, PROMPT_FORMATS, estimate_token_savings
+from rate_limiter import RateLimiter
+from row_texts import build_row_texts, deduplicate_rows
+
+
+def read_lines(path: str) -> List[str]:
+    """读取文本文件中的非空行"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(prog="python -m cli", description="AI Excel 智能标注 - 命令行批量标注")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    annotate = subparsers.add_parser("annotate", help="标注CSV、Excel、Parquet或Feather文件")
+    annotate.add_argument("input", help="输入文件（.csv / .xlsx / .xls / .parquet / .feather）")
+    annotate.add_argument("--columns", required=True, help="需要标注的列，多列用逗号分隔")
+    annotate.add_argument("--output", help="输出文件（.csv / .jsonl / .xlsx / .parquet / .feather），默认在输入文件名后加 _标注结果.csv")
+    annotate.add_argument("--column-name", default="AI_标注", help="标注结果列名（默认 AI_标注）")
+    add_annotation_arguments(annotate)
+    annotate.add_argument("--prompt-format", choices=list(PROMPT_FORMATS), default=PROMPT_FORMAT_JSON,
+                          help="提示词格式：json 返回选项文字，compact 编号输入并返回选项编号，"
+                               "logprob 逐条输出单个字母并增加置信度列（默认 json）")
+    annotate.add_argument("--chunk-size", type=int, default=10000, help="每次读入和写出的行数（默认 10000）")
+    annotate.add_argument("--no-cache", action="store_true", help="不使用标注结果缓存")
+    annotate.add_argument("--metrics-output", help="运行指标输出文件，.prom 为Prometheus文本格式，其他为JSON")
+
+    compare = subparsers.add_parser("compare-formats", help="在同一份样本上比较JSON格式和紧凑格式的token用量与标注结果")
+    compare.add_argument("input", help="输入文件（.csv / .xlsx / .xls / .parquet / .feather）")
+    compare.add_argument("--columns", required=True, help="需要标注的列，多列用逗号分隔")
+    compare.add_argument("--label-column", help="人工标注列，提供时计算两种格式的准确率")
+    compare.add_argument("--sample-size", type=int, default=200, help="样本行数（默认 200，取文件开头的数据）")
+    add_annotation_arguments(compare)
+    return parser
+
+
+def add_annotation_arguments(parser: argparse.ArgumentParser) -> None:
+    """添加标注要求、选项、模型和请求相关的公共参数"""
+    requirements = parser.add_mutually_exclusive_group(required=True)
+    requirements.add_argument("--requirements", help="标注要求")
+    requirements.add_argument("--requirements-file", help="从文件读取标注要求")
+
+    options = parser.add_mutually_exclusive_group(required=True)
+    options.add_argument("--options", help="标注选项，用逗号分隔")
+    options.add_argument("--options-file", help="从文件读取标注选项，每行一个")
+
+    parser.add_argument("--model", default=os.getenv("DEFAULT_MODEL") or "gpt-3.5-turbo", help="AI模型（默认读取 DEFAULT_MODEL）")
+    parser.add_argument("--api-key", default=None, help="API密钥（默认读取 OPENAI_API_KEY）")
+    parser.add_argument("--base-url", default=None, help="API Base URL（默认读取 OPENAI_BASE_URL）")
+    parser.add_argument("--temperature", type=float, default=0.1, help="创造性程度（默认 0.1）")
+    parser.add_argument("--max-tokens", type=int, default=8000, help="最大输出长度（默认 8000）")
+    parser.add_argument("--batch-size", type=int, default=50, help="单批最大条数（默认 50）")
+    parser.add_argument("--fixed-batch", action="store_true", help="使用固定批次大小，不按token自适应分批")
+    parser.add_argument("--max-workers", type=int, default=4, help="并发请求数（默认 4）")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟请求数上限，0 表示不限制")
+    parser.add_argument("--tpm", type=int, default=0, help="每分钟token上限，0 表示不限制")
+    parser.add_argument("--max-retries", type=int, default=5, help="限流或服务端错误时的最大重试次数（默认 5）")
+    parser.add_argument("--verbose", action="store_true", help="输出详细日志")
+
+
+def load_task(args: argparse.Namespace) -> Optional[Tuple[str, Optional[str], List[str], str, List[str]]]:
+    """读取API配置、标注列、标注要求和选项，参数有误时打印错误并返回 None"""
+    api_key = args.api_key or os.getenv("OPENAI_API_KEY", "")
+    base_url = args.base_url or os.getenv("OPENAI_BASE_URL", "") or None
+    if not api_key:
+        print("错误：请通过 --api-key 或环境变量 OPENAI_API_KEY 提供API密钥", file=sys.stderr)
+        return None
+
+    columns = [column.strip() for column in args.columns.split(",") if column.strip()]
+    annotation_requirements = (
+        args.requirements if args.requirements is not None
+        else open(args.requirements_file, 'r', encoding='utf-8').read().strip()
+    )
+    annotation_options = (
+        [option.strip() for option in args.options.split(",") if option.strip()] if args.options is not None
+        else read_lines(args.options_file)
+    )
+    if not annotation_options:
+        print("错误：标注选项不能为空", file=sys.stderr)
+        return None
+    return api_key, base_url, columns, annotation_requirements, annotation_options
+
+
+def make_annotator(args: argparse.Namespace, api_key: str, base_url: Optional[str],
+                   cache: Optional[AnnotationCache], prompt_format: str,
+                   metrics: Optional[RunMetrics] = None) -> AIAnnotator:
+    """按命令行参数创建带限流器的标注器"""
+    rate_limiter = RateLimiter(
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        max_concurrency=args.max_workers,
+        max_retries=args.max_retries
+    )
+    return AIAnnotator(
+        api_key, base_url,
+        cache=cache, capabilities=CapabilityRegistry(),
+        rate_limiter=rate_limiter,
+        clients=ClientRegistry(),
+        prompt_format=prompt_format,
+        metrics=metrics
+    )
+
+
+def plan_batches(args: argparse.Namespace, data: List[str], annotation_requirements: str,
+                 annotation_options: List[str], prompt_format: str) -> List[int]:
+    """按命令行参数切分批次"""
+    if args.fixed_batch:
+        return fixed_batch_sizes(len(data), args.batch_size)
+    return plan_batch_sizes(
+        data, args.batch_size, annotation_requirements, annotation_options,
+        args.model, args.max_tokens, prompt_format
+    )
+
+
+def run_annotate(args: argparse.Namespace) -> int:
+    """执行标注任务，返回退出码"""
+    task = load_task(args)
+    if task is None:
+        return 2
+    api_key, base_url, columns, annotation_requirements, annotation_options = task
+
+    output = args.output or f"{os.path.splitext(args.input)[0]}_标注结果.csv"
+
+    # 创建写出器会清空已有的输出文件，先用第一块检查列名，列名写错时不会覆盖已有结果
+    chunks = iter_table_chunks(args.input, args.chunk_size)
+    first_chunk = next(chunks, None)
+    if first_chunk is not None:
+        missing = [column for column in columns if column not in first_chunk.columns]
+        if missing:
+            print(f"错误：输入文件中找不到列 {', '.join(missing)}", file=sys.stderr)
+            return 2
+        chunks = itertools.chain([first_chunk], chunks)
+
+    # 单字母分类需要每条数据的置信度，缓存不保存置信度，不使用缓存
+    cache = None if args.no_cache or args.prompt_format == PROMPT_FORMAT_LOGPROB else AnnotationCache(
+        max_entries=int(os.getenv("ANNOTATION_CACHE_MAX_ENTRIES", "200000")),
+        max_age_days=float(os.getenv("ANNOTATION_CACHE_MAX_AGE_DAYS", "30"))
+    )
+    metrics = RunMetrics()
+    annotator = make_annotator(args, api_key, base_url, cache, args.prompt_format, metrics)
+    rate_limiter = annotator.rate_limiter
+
+    writer = ChunkWriter(output, categorical_columns=[args.column_name])
+    started_at = time.monotonic()
+    total_rows = 0
+    total_unique = 0
+    total_failed = 0
+    total_batches = 0
+
+    try:
+        for chunk in chunks:
+            data_to_annotate = build_row_texts(chunk, columns)
+            unique_data, row_to_unique = deduplicate_rows(data_to_annotate)
+            batch_sizes = plan_batches(args, unique_data, annotation_requirements, annotation_options, args.prompt_format)
+
+            unique_annotations = annotate_concurrently(
+                annotator,
+                unique_data,
+                args.batch_size,
+                annotation_requirements,
+                annotation_options,
+                model=args.model,
+                temperature=args.temperature,
+                max_tokens=args.max_tokens,
+                max_workers=args.max_workers,
+                batch_sizes=batch_sizes
+            )
+            annotations = [unique_annotations[i] for i in row_to_unique]
+
+            chunk = chunk.copy()
+            chunk[args.column_name] = annotations
+            if args.prompt_format == PROMPT_FORMAT_LOGPROB:
+                chunk[f"{args.column_name}_置信度"] = pd.Series(
+                    [annotator.confidences.get(unique_data[i]) for i in row_to_unique], index=chunk.index, dtype=float
+                )
+                annotator.confidences.clear()
+            writer.write(chunk)
+
+            total_rows += len(chunk)
+            total_unique += len(unique_data)
+            total_batches += len(batch_sizes)
+            total_failed += sum(1 for label in annotations if label == "标注失败")
+            metrics.update_progress(total_rows, total_rows)
+            elapsed = time.monotonic() - started_at
+            print(
+                f"已标注 {total_rows} 行 | {total_rows / max(elapsed, 1e-9):.1f} 行/秒 | "
+                f"请求批次 {total_batches} | 失败 {total_failed} | 用时 {elapsed:.1f}s",
+                file=sys.stderr
+            )
+    finally:
+        writer.close()
+        metrics.finish()
+        if args.metrics_output:
+            with open(args.metrics_output, 'w', encoding='utf-8') as f:
+                f.write(metrics.to_prometheus() if args.metrics_output.endswith(".prom") else metrics.to_json())
+
+    elapsed = time.monotonic() - started_at
+    print(f"✅ 标注完成：{total_rows} 行，结果已写入 {output}", file=sys.stderr)
+    print(f"   唯一文本 {total_unique} 条，请求批次 {total_batches}，失败 {total_failed} 行", file=sys.stderr)
+    print(f"   总用时 {elapsed:.1f}s，吞吐 {total_rows / max(elapsed, 1e-9):.1f} 行/秒", file=sys.stderr)
+    if cache:
+        stats = cache.stats()
+        print(f"   缓存命中 {stats['hits']} 条，未命中 {stats['misses']} 条", file=sys.stderr)
+    if rate_limiter.retries:
+        print(f"   重试 {rate_limiter.retries} 次，其中限流 {rate_limiter.rate_limited} 次", file=sys.stderr)
+    if annotator.prompt_tokens:
+        print(
+            f"   实际消耗输入 {annotator.prompt_tokens} token（命中提示词缓存 {annotator.cached_tokens} token），"
+            f"输出 {annotator.completion_tokens} token",
+            file=sys.stderr
+        )
+        snapshot = metrics.snapshot()
+        print(
+            f"   预计花费 ${snapshot['cost']:.4f}" + ("" if snapshot['cost_complete'] else "（模型不在价格表中，未计入）"),
+            file=sys.stderr
+        )
+    if args.metrics_output:
+        print(f"   运行指标已写入 {args.metrics_output}", file=sys.stderr)
+    return 0
+
+
+def run_compare_formats(args: argparse.Namespace) -> int:
+    """在同一份样本上分别用JSON格式和紧凑格式标注，比较token用量和标注结果"""
+    task = load_task(args)
+    if task is None:
+        return 2
+    api_key, base_url, columns, annotation_requirements, annotation_options = task
+
+    sample = next(iter_table_chunks(args.input, args.sample_size), None)
+    if sample is None or sample.empty:
+        print("错误：输入文件为空", file=sys.stderr)
+        return 2
+    missing = [column for column in columns + ([args.label_column] if args.label_column else []) if column not in sample.columns]
+    if missing:
+        print(f"错误：输入文件中找不到列 {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    data = build_row_texts(sample, columns)
+    estimate = estimate_token_savings(data, annotation_options)
+    print(
+        f"预计每行token：JSON格式 输入 {estimate['json_input']:.1f} / 输出 {estimate['json_output']:.1f}，"
+        f"紧凑格式 输入 {estimate['compact_input']:.1f} / 输出 {estimate['compact_output']:.1f}，"
+        f"节省 {estimate['saving_ratio']:.0%}",
+        file=sys.stderr
+    )
+
+    results = {}
+    for prompt_format in (PROMPT_FORMAT_JSON, PROMPT_FORMAT_COMPACT):
+        # 不使用缓存，两种格式都实际请求模型
+        annotator = make_annotator(args, api_key, base_url, None, prompt_format)
+        started_at = time.monotonic()
+        annotations = annotate_concurrently(
+            annotator,
+            data,
+            args.batch_size,
+            annotation_requirements,
+            annotation_options,
+            model=args.model,
+            temperature=args.temperature,
+            max_tokens=args.max_tokens,
+            max_workers=args.max_workers,
+            batch_sizes=plan_batches(args, data, annotation_requirements, annotation_options, prompt_format)
+        )
+        results[prompt_format] = annotations
+        elapsed = time.monotonic() - started_at
+        failed = sum(1 for label in annotations if label == "标注失败")
+        line = (
+            f"{PROMPT_FORMATS[prompt_format]}：输入 {annotator.prompt_tokens / len(data):.1f} token/行"
+            f"（缓存 {annotator.cached_tokens / len(data):.1f}），"
+            f"输出 {annotator.completion_tokens / len(data):.1f} token/行，失败 {failed} 行，用时 {elapsed:.1f}s"
+        )
+        if args.label_column:
+            truth = sample[args.label_column].astype(str).tolist()
+            accuracy = sum(1 for label, expected in zip(annotations, truth) if label == expected) / len(data)
+            line += f"，准确率 {accuracy:.1%}"
+        print(line, file=sys.stderr)
+
+    agreement = sum(
+        1 for a, b in zip(results[PROMPT_FORMAT_JSON], results[PROMPT_FORMAT_COMPACT]) if a == b
+    ) / len(data)
+    print(f"两种格式结果一致率 {agreement:.1%}（样本 {len(data)} 行）", file=sys.stderr)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    if args.command == "annotate":
+        return run_annotate(args)
+    if args.command == "compare-formats":
+        return run_compare_formats(args)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
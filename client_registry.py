@@ -0,0 +1,68 @@
+import hashlib
+import importlib.util
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# 安装了 h2 时启用HTTP/2，多个并发请求复用同一条连接
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def api_key_fingerprint(api_key: str) -> str:
+    """API密钥的哈希，用作缓存键，避免明文密钥长期驻留或写入文件"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class ClientRegistry:
+    """进程内共享的OpenAI客户端登记表
+
+    按 (API密钥哈希, base_url) 复用客户端及其httpx连接池，
+    连接测试、标注测试和标注任务之间保持长连接，不必每次重新建立TLS连接。
+    """
+
+    def __init__(self, max_connections: int = 64, max_keepalive_connections: int = 32,
+                 keepalive_expiry: float = 120.0, max_clients: int = 32):
+        """初始化登记表
+
+        max_clients 为最多保留的客户端数，超出时丢弃最久未使用的客户端。
+        """
+        # 只用到密钥哈希的模块（如模型列表缓存）不必加载openai SDK，创建登记表时才导入
+        import httpx
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[Tuple[str, str], OpenAI]" = OrderedDict()
+
+    @staticmethod
+    def _key(api_key: str, base_url: Optional[str]) -> Tuple[str, str]:
+        return api_key_fingerprint(api_key), (base_url or "").rstrip("/")
+
+    def get(self, api_key: str, base_url: Optional[str] = None) -> "OpenAI":
+        """获取客户端，不存在时创建"""
+        from openai import DefaultHttpxClient, OpenAI
+
+        key = self._key(api_key, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultHttpxClient(limits=self.limits, http2=HTTP2_AVAILABLE)
+            )
+            self._clients[key] = client
+            # 被丢弃的客户端可能仍有请求在途，不主动关闭，由垃圾回收释放连接
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return client
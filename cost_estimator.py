@@ -0,0 +1,114 @@
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from batching import fixed_batch_sizes, plan_batch_sizes
+from pricing import MODEL_PRICING, estimate_cost
+from prompt_formats import (
+    OUTPUT_COMPACT, OUTPUT_JSON, OUTPUT_LOGPROB, PROMPT_FORMAT_COMPACT, PROMPT_FORMAT_LOGPROB,
+    build_data_message, build_instructions, estimate_prompt_tokens
+)
+from row_texts import build_row_texts
+from token_estimator import estimate_tokens
+
+# 估算时抽取的样本行数，与文件大小无关，保证大文件也能在毫秒级完成
+ESTIMATE_SAMPLE_SIZE = 1000
+
+# 服务端提示词缓存要求的最短前缀（OpenAI为1024 token），系统消息达到该长度时第二次请求起按缓存价格计费
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# 预估用时：每次请求的固定开销（秒）加上按输出速度生成的时间
+REQUEST_OVERHEAD_SECONDS = 1.0
+OUTPUT_TOKENS_PER_SECOND = 50.0
+
+
+def stratified_sample_positions(total_rows: int, sample_size: int = ESTIMATE_SAMPLE_SIZE, seed: int = 0) -> np.ndarray:
+    """分层抽样：把数据按位置等分为 sample_size 段，每段随机取一行
+
+    文件中不同位置的数据（如按时间或类别排序）都会被抽到，比只取开头若干行更有代表性。
+    """
+    if total_rows <= sample_size:
+        return np.arange(total_rows)
+    bounds = np.linspace(0, total_rows, sample_size + 1).astype(np.int64)
+    rng = np.random.default_rng(seed)
+    return bounds[:-1] + (rng.random(sample_size) * (bounds[1:] - bounds[:-1])).astype(np.int64)
+
+
+def count_unique_rows(df: pd.DataFrame, columns: List[str]) -> int:
+    """选中列拼接后的唯一文本数，即实际需要标注的行数"""
+    return int(pd.Series(build_row_texts(df, columns), dtype=object).nunique())
+
+
+def estimate_job(df: pd.DataFrame, columns: List[str], annotation_requirements: str,
+                 annotation_options: List[str], model: str, prompt_format: str,
+                 max_batch_size: int, max_tokens: int, max_workers: int,
+                 adaptive_batching: bool = True, unique_rows: Optional[int] = None,
+                 requests_per_minute: int = 0, tokens_per_minute: int = 0) -> Dict:
+    """标注前预估token用量、请求数、用时和费用
+
+    对分层抽样的样本按实际的提示词和分批方式计算token，再按唯一文本数外推到全部数据。
+    unique_rows 为去重后的行数，未提供时按总行数估算（不考虑去重）。
+    返回 rows、unique_rows、requests、input_tokens、cached_tokens、output_tokens、
+    seconds（按并发数和RPM/TPM上限估算的用时）、cost（所选模型，未知模型为 None）
+    以及 costs（价格表中各模型的费用，用于比较）。
+    """
+    total_rows = len(df)
+    unique_rows = total_rows if unique_rows is None else unique_rows
+    sample = build_row_texts(df.iloc[stratified_sample_positions(total_rows)], columns)
+    if not sample or not unique_rows:
+        return {
+            "rows": total_rows, "unique_rows": 0, "requests": 0, "input_tokens": 0, "cached_tokens": 0,
+            "output_tokens": 0, "seconds": 0.0, "cost": 0.0, "costs": {name: 0.0 for name in MODEL_PRICING},
+        }
+
+    output_mode = {PROMPT_FORMAT_COMPACT: OUTPUT_COMPACT, PROMPT_FORMAT_LOGPROB: OUTPUT_LOGPROB}.get(prompt_format, OUTPUT_JSON)
+    system_tokens = estimate_tokens(build_instructions(annotation_requirements, annotation_options, output_mode))
+
+    if prompt_format == PROMPT_FORMAT_LOGPROB:
+        # 逐条请求，每次只输出一个字母
+        requests_per_row = 1.0
+        data_tokens = sum(estimate_tokens(build_data_message([text], output_mode)) for text in sample)
+        output_tokens = len(sample)
+    else:
+        if adaptive_batching:
+            batch_sizes = plan_batch_sizes(sample, max_batch_size, annotation_requirements, annotation_options,
+                                           model, max_tokens, prompt_format)
+        else:
+            batch_sizes = fixed_batch_sizes(len(sample), max_batch_size)
+        requests_per_row = len(batch_sizes) / len(sample)
+        data_tokens = 0
+        output_tokens = 0
+        start = 0
+        for size in batch_sizes:
+            batch = sample[start:start + size]
+            start += size
+            data_tokens += estimate_tokens(build_data_message(batch, output_mode))
+            output_tokens += estimate_prompt_tokens(batch, annotation_options, prompt_format)["output"]
+
+    scale = unique_rows / len(sample)
+    requests = max(1, math.ceil(unique_rows * requests_per_row))
+    input_tokens = requests * system_tokens + round(data_tokens * scale)
+    cached_tokens = (requests - 1) * system_tokens if system_tokens >= PROMPT_CACHE_MIN_TOKENS else 0
+    output_tokens = round(output_tokens * scale)
+
+    # 并发受 max_workers 限制，同时不能快于RPM/TPM上限
+    seconds_per_request = REQUEST_OVERHEAD_SECONDS + output_tokens / requests / OUTPUT_TOKENS_PER_SECOND
+    seconds = math.ceil(requests / max(1, max_workers)) * seconds_per_request
+    if requests_per_minute > 0:
+        seconds = max(seconds, requests / requests_per_minute * 60)
+    if tokens_per_minute > 0:
+        seconds = max(seconds, input_tokens / tokens_per_minute * 60)
+
+    return {
+        "rows": total_rows,
+        "unique_rows": unique_rows,
+        "requests": requests,
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "output_tokens": output_tokens,
+        "seconds": seconds,
+        "cost": estimate_cost(model, input_tokens, output_tokens, cached_tokens),
+        "costs": {name: estimate_cost(name, input_tokens, output_tokens, cached_tokens) for name in MODEL_PRICING},
+    }
@@ -0,0 +1,371 @@
+import codecs
+import io
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# CSV文件按顺序尝试的编码
+CSV_ENCODINGS = ['utf-8', 'gbk', 'gb2312', 'latin-1']
+
+# Arrow IPC（Feather v2）文件的扩展名
+ARROW_IPC_EXTENSIONS = ('feather', 'arrow')
+
+# 编码探测读取的字节数
+ENCODING_SNIFF_BYTES = 64 * 1024
+
+
+def detect_csv_encoding(fileobj, sample_size: int = ENCODING_SNIFF_BYTES) -> str:
+    """读取文件开头的一段字节探测编码，读取后将文件指针复位"""
+    position = fileobj.tell()
+    sample = fileobj.read(sample_size)
+    fileobj.seek(position)
+    if isinstance(sample, str):
+        return 'utf-8'
+
+    for encoding in CSV_ENCODINGS:
+        try:
+            # 增量解码，容忍样本末尾被截断的多字节字符
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return CSV_ENCODINGS[-1]
+
+
+def _sniff_encoding(source) -> str:
+    """探测文件路径或文件对象的编码"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return detect_csv_encoding(f)
+    source.seek(0)
+    return detect_csv_encoding(source)
+
+
+def _detect_file_encoding(path: str) -> str:
+    """流式解码整个文件，从开头探测到的编码起依次尝试，返回能完整解码的第一个编码
+
+    只看开头的探测在非ASCII字符出现得较晚时会猜错，逐块读取时才在中途出错；
+    在开始处理前确定编码，避免已经发出请求后才失败。
+    """
+    encoding = _sniff_encoding(path)
+    for candidate in CSV_ENCODINGS[CSV_ENCODINGS.index(encoding):]:
+        decoder = codecs.getincrementaldecoder(candidate)()
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    decoder.decode(block)
+            decoder.decode(b'', final=True)
+            return candidate
+        except UnicodeDecodeError:
+            continue
+    return CSV_ENCODINGS[-1]
+
+
+def _iter_csv_chunks(source, chunk_size: int, encoding: str,
+                     dtype_backend: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """按指定编码分块读取CSV"""
+    if not isinstance(source, str):
+        source.seek(0)
+    options = {"dtype_backend": dtype_backend} if dtype_backend else {}
+    with pd.read_csv(source, encoding=encoding, chunksize=chunk_size, **options) as reader:
+        yield from reader
+
+
+def _dedup_column_names(names: List[str]) -> List[str]:
+    """与 pandas.read_excel 相同的重名列处理：重复的列名依次加 .1、.2 等后缀"""
+    counts: Dict[str, int] = {}
+    result = []
+    for name in names:
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        result.append(name)
+        counts[name] = count + 1
+    return result
+
+
+def _records_to_frame(records: List[tuple], columns: List[str]) -> pd.DataFrame:
+    """把单元格值转换为数据框，空单元格与 pandas.read_excel 一样为 NaN（而不是 None）"""
+    df = pd.DataFrame.from_records(records, columns=columns)
+    for column, dtype in zip(df.columns, df.dtypes):
+        if dtype == object:
+            values = df[column]
+            df[column] = values.where(values.notna(), np.nan)
+    return df.infer_objects()
+
+
+def _iter_xlsx_chunks(source, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """以openpyxl只读模式流式读取xlsx，不在内存中构建完整的单元格树"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = _dedup_column_names(
+            [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        )
+        buffer: List[tuple] = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunk_size:
+                yield _records_to_frame(buffer, columns)
+                buffer = []
+        if buffer:
+            yield _records_to_frame(buffer, columns)
+    finally:
+        workbook.close()
+
+
+def iter_table_chunks(path: str, chunk_size: int = 10000) -> Iterator[pd.DataFrame]:
+    """分块读取CSV、Excel、Parquet或Feather文件，每块最多 chunk_size 行"""
+    file_extension = path.rsplit('.', 1)[-1].lower()
+
+    if file_extension == 'csv':
+        yield from _iter_csv_chunks(path, chunk_size, _detect_file_encoding(path))
+
+    elif file_extension == 'xlsx':
+        yield from _iter_xlsx_chunks(path, chunk_size)
+
+    elif file_extension == 'xls':
+        df = pd.read_excel(path, engine='xlrd')
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+
+    elif file_extension == 'parquet':
+        import pyarrow.parquet as pq
+
+        # 按行组流式读取，无需文本解析
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+
+    elif file_extension in ARROW_IPC_EXTENSIONS:
+        import pyarrow as pa
+        import pyarrow.ipc
+
+        # 内存映射零拷贝读取，按块转换为数据框
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+            for start in range(0, table.num_rows, chunk_size):
+                yield table.slice(start, chunk_size).to_pandas()
+
+    else:
+        raise ValueError(f"不支持的文件格式: .{file_extension}，请使用CSV、Excel、Parquet或Feather文件")
+
+
+def read_table(source, filename: str, dtype_backend: Optional[str] = None,
+               chunk_size: int = 100000) -> pd.DataFrame:
+    """读取完整的CSV、Excel、Parquet或Feather文件
+
+    CSV只探测一次编码并分块解析，xlsx使用只读模式流式读取，Parquet/Feather直接按列读取；
+    dtype_backend='pyarrow' 时使用PyArrow数据类型，字符串列内存占用更接近数据本身大小。
+    """
+    file_extension = filename.rsplit('.', 1)[-1].lower()
+
+    if file_extension == 'csv':
+        # 通常一次解析即可；探测只看文件开头，若后面的内容解码失败再换用后续编码
+        encoding = _sniff_encoding(source)
+        candidates = CSV_ENCODINGS[CSV_ENCODINGS.index(encoding):]
+        for i, candidate in enumerate(candidates):
+            try:
+                chunks = list(_iter_csv_chunks(source, chunk_size, candidate, dtype_backend))
+                break
+            except UnicodeDecodeError:
+                if i == len(candidates) - 1:
+                    raise
+    elif file_extension == 'xlsx':
+        chunks = list(_iter_xlsx_chunks(source, chunk_size))
+    elif file_extension == 'xls':
+        chunks = [pd.read_excel(source, engine='xlrd')]
+    elif file_extension == 'parquet':
+        # 列式文件直接读取，跳过文本解析
+        options = {"dtype_backend": dtype_backend} if dtype_backend else {}
+        return pd.read_parquet(source, **options)
+    elif file_extension in ARROW_IPC_EXTENSIONS:
+        options = {"dtype_backend": dtype_backend} if dtype_backend else {}
+        return pd.read_feather(source, **options)
+    else:
+        raise ValueError(f"不支持的文件格式: .{file_extension}，请使用CSV、Excel、Parquet或Feather文件")
+
+    if not chunks:
+        return pd.DataFrame()
+    df = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+    del chunks
+
+    if dtype_backend and file_extension != 'csv':
+        df = df.convert_dtypes(dtype_backend=dtype_backend)
+    return df
+
+
+def _xlsx_row(row: tuple) -> list:
+    """转换一行数据为openpyxl可写入的值，缺失值写为空单元格"""
+    return [None if pd.isna(value) else value for value in row]
+
+
+def dataframe_to_xlsx_bytes(df: pd.DataFrame, sheet_name: str = '标注结果') -> bytes:
+    """以openpyxl只写模式生成xlsx，逐行写入，不在内存中构建完整的单元格树"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append([str(column) for column in df.columns])
+    for row in df.itertuples(index=False, name=None):
+        sheet.append(_xlsx_row(row))
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    workbook.close()
+    return buffer.getvalue()
+
+
+def export_dataframe(df: pd.DataFrame, file_format: str,
+                     categorical_columns: Optional[List[str]] = None) -> bytes:
+    """将数据框导出为指定格式（csv / xlsx / json / parquet / feather）的字节内容
+
+    Parquet和Feather中 categorical_columns 指定的列（如标注结果列）以字典编码存储。
+    """
+    if file_format == 'csv':
+        # 带BOM的UTF-8，Excel直接打开中文不乱码
+        return df.to_csv(index=False).encode('utf-8-sig')
+    if file_format == 'xlsx':
+        return dataframe_to_xlsx_bytes(df)
+    if file_format == 'json':
+        return df.to_json(orient='records', force_ascii=False, indent=2).encode('utf-8')
+    if file_format in ('parquet',) + ARROW_IPC_EXTENSIONS:
+        columns = [column for column in (categorical_columns or []) if column in df.columns]
+        if columns:
+            df = df.astype({column: 'category' for column in columns})
+        buffer = io.BytesIO()
+        if file_format == 'parquet':
+            df.to_parquet(buffer, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(buffer)
+        return buffer.getvalue()
+    raise ValueError(f"不支持的导出格式: {file_format}")
+
+
+class ChunkWriter:
+    """分块写出标注结果，支持CSV、JSONL、XLSX、Parquet和Feather"""
+
+    def __init__(self, path: str, categorical_columns: Optional[List[str]] = None):
+        """初始化写出器，按扩展名决定输出格式
+
+        Parquet和Feather中 categorical_columns 指定的列以字典编码存储，
+        各块共用一个只增不减的字典，保证Feather文件中的字典只做增量追加。
+        """
+        self.path = path
+        self.format = path.rsplit('.', 1)[-1].lower()
+        if self.format not in ('csv', 'jsonl', 'xlsx', 'parquet') + ARROW_IPC_EXTENSIONS:
+            raise ValueError(f"不支持的输出格式: .{self.format}，请使用 .csv、.jsonl、.xlsx、.parquet 或 .feather")
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.categorical_columns = list(categorical_columns or [])
+        self._header_written = False
+        self._workbook = None
+        self._sheet = None
+        self._arrow_writer = None
+        self._schema = None
+        self._dictionaries: Dict[str, Dict[str, int]] = {column: {} for column in self.categorical_columns}
+        if self.format == 'xlsx':
+            from openpyxl import Workbook
+
+            # 只写模式逐行追加，内存占用与总行数无关
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet('标注结果')
+        elif self.format in ('csv', 'jsonl'):
+            # 清空已有文件，之后逐块追加
+            open(path, 'w', encoding='utf-8-sig' if self.format == 'csv' else 'utf-8').close()
+
+    def _to_arrow(self, df: pd.DataFrame):
+        """转换为Arrow表，分类列按全局字典编码，其余列对齐第一块确定的类型
+
+        各块的类型由pandas分别推断，同一列可能在前一块全为空（推断为浮点数）、后一块为文本。
+        为此对象列统一按字符串写出，第一块中全为空的列也按字符串写出，后续块再转换为这些类型。
+        """
+        import pyarrow as pa
+
+        object_columns = [
+            column for column, dtype in df.dtypes.items()
+            if dtype == object and column not in self.categorical_columns
+        ]
+        if object_columns:
+            df = df.copy()
+            for column in object_columns:
+                values = df[column]
+                df[column] = values.astype(str).where(values.notna(), None)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        for column in self.categorical_columns:
+            if column not in df.columns:
+                continue
+            mapping = self._dictionaries[column]
+            indices = []
+            for value in df[column].astype(str):
+                if value not in mapping:
+                    mapping[value] = len(mapping)
+                indices.append(mapping[value])
+            array = pa.DictionaryArray.from_arrays(
+                pa.array(indices, type=pa.int32()), pa.array(list(mapping), type=pa.string())
+            )
+            table = table.set_column(table.schema.get_field_index(column), column, array)
+
+        if self._schema is None:
+            fields = [
+                field.with_type(pa.string())
+                if table.column(i).null_count == table.num_rows and not pa.types.is_dictionary(field.type)
+                else field
+                for i, field in enumerate(table.schema)
+            ]
+            # 不保留pandas元数据：其中记录的是第一块推断的类型，与调整后的类型不一致
+            self._schema = pa.schema(fields)
+        return table.cast(self._schema)
+
+    def write(self, df: pd.DataFrame) -> None:
+        """追加写出一块数据"""
+        if self.format == 'csv':
+            df.to_csv(self.path, mode='a', index=False, header=not self._header_written, encoding='utf-8')
+        elif self.format == 'jsonl':
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in df.to_dict(orient='records'):
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        elif self.format == 'xlsx':
+            if not self._header_written:
+                self._sheet.append([str(column) for column in df.columns])
+            for row in df.itertuples(index=False, name=None):
+                self._sheet.append(_xlsx_row(row))
+        else:
+            table = self._to_arrow(df)
+            if self._arrow_writer is None:
+                if self.format == 'parquet':
+                    import pyarrow.parquet as pq
+
+                    self._arrow_writer = pq.ParquetWriter(self.path, self._schema)
+                else:
+                    import pyarrow.ipc
+
+                    self._arrow_writer = pyarrow.ipc.new_file(
+                        self.path, self._schema,
+                        options=pyarrow.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+                    )
+            self._arrow_writer.write_table(table)
+        self._header_written = True
+
+    def close(self) -> None:
+        """完成写出"""
+        if self._workbook is not None:
+            self._workbook.save(self.path)
+            self._workbook.close()
+            self._workbook = None
+        if self._arrow_writer is not None:
+            self._arrow_writer.close()
+            self._arrow_writer = None
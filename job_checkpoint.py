@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List
+
+# 默认断点目录：docker-compose 中挂载的 ./data 目录
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.getenv("DATA_DIR", "data"), "jobs")
+
+
+class JobCheckpoint:
+    """标注任务断点文件
+
+    每个任务对应一个只追加的JSONL文件，每行记录一个已完成批次的标注结果。
+    任务中断（刷新页面、重启容器等）后重新提交相同任务即可从断点继续。
+    """
+
+    def __init__(self, job_id: str, directory: str = DEFAULT_CHECKPOINT_DIR):
+        """初始化断点文件"""
+        self.job_id = job_id
+        self.path = os.path.join(directory, f"{job_id}.jsonl")
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_job_id(data: List[str], annotation_requirements: str, annotation_options: List[str],
+                    model: str, temperature: float, max_tokens: int, batch_sizes: List[int]) -> str:
+        """根据数据、批次划分和标注配置计算任务ID，配置相同的任务共享同一断点"""
+        digest = hashlib.sha256()
+        header = [annotation_requirements, list(annotation_options), model,
+                  round(float(temperature), 4), max_tokens, list(batch_sizes), len(data)]
+        digest.update(json.dumps(header, ensure_ascii=False).encode("utf-8"))
+        for text in data:
+            digest.update(text.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()[:32]
+
+    def load(self) -> Dict[int, List[str]]:
+        """读取已完成的批次，返回 {批次下标: 标注结果}"""
+        completed: Dict[int, List[str]] = {}
+        if not os.path.exists(self.path):
+            return completed
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    completed[int(record["batch"])] = list(record["annotations"])
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    # 进程中断时最后一行可能写了一半，直接忽略
+                    continue
+        return completed
+
+    def append(self, batch_index: int, annotations: List[str]) -> None:
+        """追加一个已完成批次并立即落盘"""
+        line = json.dumps({"batch": batch_index, "annotations": annotations}, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self) -> None:
+        """任务完成后删除断点文件"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,192 @@
+import itertools
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+JOB_STATUS_LABELS = {
+    JOB_QUEUED: "排队中",
+    JOB_RUNNING: "运行中",
+    JOB_DONE: "已完成",
+    JOB_FAILED: "失败",
+    JOB_CANCELLED: "已取消",
+}
+
+
+class AnnotationJob:
+    """后台标注任务
+
+    保存任务状态、进度、运行日志和结果，页面重新运行时按任务ID查询。
+    """
+
+    def __init__(self, owner: str, title: str, fn: Callable[["AnnotationJob"], Any]):
+        """初始化任务"""
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.title = title
+        self.fn = fn
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done_rows = 0
+        self.total_rows = 0
+        self.done_batches = 0
+        self.total_batches = 0
+        self.status_text = "等待调度..."
+        self.messages: Deque[tuple] = deque(maxlen=100)
+        self.summary: List[tuple] = []
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+        # 运行指标（RunMetrics），由任务函数设置，页面据此展示吞吐、剩余时间和费用
+        self.metrics: Optional[Any] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    @property
+    def progress(self) -> float:
+        if not self.total_rows:
+            return 1.0 if self.status == JOB_DONE else 0.0
+        return min(1.0, self.done_rows / self.total_rows)
+
+    def update_progress(self, done_rows: int, total_rows: int, done_batches: int, total_batches: int) -> None:
+        """更新进度"""
+        self.done_rows = done_rows
+        self.total_rows = total_rows
+        self.done_batches = done_batches
+        self.total_batches = total_batches
+        self.status_text = f"已完成 {done_batches}/{total_batches} 批数据..."
+        if self.metrics is not None:
+            self.metrics.update_progress(done_rows, total_rows)
+
+    def add_message(self, level: int, message: str) -> None:
+        """记录运行日志（标注器的警告和错误）"""
+        self.messages.append((level, message))
+
+    def add_summary(self, level: str, message: str) -> None:
+        """记录完成后展示的汇总信息，level 为 success / info / warning"""
+        self.summary.append((level, message))
+
+
+class JobManager:
+    """后台任务管理器
+
+    固定数量的工作线程执行任务，按用户轮询调度：每次从下一个有排队任务的用户
+    取一个任务，避免某个用户提交的大量任务长期占满所有工作线程。
+    """
+
+    def __init__(self, max_running_jobs: int = 2, max_finished_per_owner: int = 5):
+        """初始化任务管理器并启动工作线程"""
+        self.max_finished_per_owner = max_finished_per_owner
+        self._jobs: Dict[str, AnnotationJob] = {}
+        self._queues: Dict[str, Deque[AnnotationJob]] = {}
+        self._owners: Deque[str] = deque()
+        self._condition = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"annotation-job-{i}", daemon=True)
+            for i in range(max(1, max_running_jobs))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, owner: str, title: str, fn: Callable[[AnnotationJob], Any]) -> AnnotationJob:
+        """提交任务，fn(job) 的返回值保存为任务结果"""
+        job = AnnotationJob(owner, title, fn)
+        with self._condition:
+            self._jobs[job.id] = job
+            if owner not in self._queues:
+                self._queues[owner] = deque()
+                self._owners.append(owner)
+            self._queues[owner].append(job)
+            self._condition.notify()
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[AnnotationJob]:
+        """按ID查询任务"""
+        with self._condition:
+            return self._jobs.get(job_id) if job_id else None
+
+    def jobs_for(self, owner: str) -> List[AnnotationJob]:
+        """查询某个用户的全部任务，最新的在前"""
+        with self._condition:
+            jobs = [job for job in self._jobs.values() if job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> None:
+        """取消任务：排队中的直接移除，运行中的在已发出的批次完成后停止"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return
+            job.cancel_event.set()
+            queue = self._queues.get(job.owner)
+            if job.status == JOB_QUEUED and queue and job in queue:
+                queue.remove(job)
+                job.status = JOB_CANCELLED
+                job.status_text = "已取消"
+                job.finished_at = time.time()
+
+    def _next_job(self) -> Optional[AnnotationJob]:
+        """轮询各用户的队列，取出下一个任务（调用方需持有锁）"""
+        for _ in range(len(self._owners)):
+            owner = self._owners[0]
+            self._owners.rotate(-1)
+            queue = self._queues[owner]
+            if queue:
+                return queue.popleft()
+        return None
+
+    def _worker(self) -> None:
+        """工作线程主循环"""
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+                job.status = JOB_RUNNING
+                job.started_at = time.time()
+                job.status_text = "正在准备数据..."
+
+            try:
+                job.result = job.fn(job)
+                # 任务函数返回了完整结果时，即使之后才点击取消也保留结果
+                cancelled = job.result is None and job.cancel_event.is_set()
+                job.status = JOB_CANCELLED if cancelled else JOB_DONE
+                job.status_text = "已取消" if cancelled else "✅ 标注完成！"
+            except Exception as e:
+                if job.cancel_event.is_set():
+                    job.status = JOB_CANCELLED
+                    job.status_text = "已取消"
+                else:
+                    logger.exception("标注任务 %s 失败", job.id)
+                    job.status = JOB_FAILED
+                    job.error = str(e)
+                    job.status_text = f"标注过程中出现错误：{str(e)}"
+            finally:
+                job.finished_at = time.time()
+                if job.metrics is not None:
+                    job.metrics.finish()
+                self._prune(job.owner)
+
+    def _prune(self, owner: str) -> None:
+        """每个用户只保留最近的若干个已结束任务，释放结果占用的内存"""
+        with self._condition:
+            finished = [job for job in self._jobs.values() if job.owner == owner and job.finished]
+            finished.sort(key=lambda job: job.finished_at or 0, reverse=True)
+            for job in itertools.islice(finished, self.max_finished_per_owner, None):
+                del self._jobs[job.id]
@@ -0,0 +1,217 @@
+import json
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Optional, Tuple
+
+from pricing import estimate_cost
+
+# 请求耗时直方图的分桶上界（秒），与Prometheus直方图的 le 标签对应
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 计算分位数时最多保留的最近请求耗时
+MAX_LATENCY_SAMPLES = 10000
+
+
+def usage_counts(usage) -> Tuple[int, int, int]:
+    """从接口返回的 usage 中取出 (输入token, 输出token, 命中缓存的输入token)"""
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (
+        usage.prompt_tokens or 0,
+        usage.completion_tokens or 0,
+        getattr(details, "cached_tokens", None) or 0,
+    )
+
+
+def error_reason(error: BaseException) -> str:
+    """把异常归类为简短的失败原因，HTTP错误按状态码归类"""
+    # 出错时SDK必然已经加载，这里导入不增加开销；页面只展示指标时不必加载SDK
+    import openai
+
+    if isinstance(error, openai.APIStatusError):
+        return f"http_{error.status_code}"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    return type(error).__name__
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """一次标注任务的运行指标
+
+    按模型记录每次请求（含重试）的耗时、token用量和结果，
+    以及重试原因、回退路径和失败原因，线程安全，可导出为JSON或Prometheus文本格式。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.done_rows = 0
+        self.total_rows = 0
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self.latencies = deque(maxlen=MAX_LATENCY_SAMPLES)
+        self.retries = Counter()
+        self.fallbacks = Counter()
+        # 失败原因 -> 行数（按出错的请求统计，拆分重试前的失败也计入）
+        self.failures = Counter()
+
+    def _model(self, model: str) -> Dict[str, Any]:
+        entry = self.models.get(model)
+        if entry is None:
+            entry = self.models[model] = {
+                "requests": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cached_tokens": 0,
+                "latency_sum": 0.0,
+                "latency_buckets": [0] * len(LATENCY_BUCKETS),
+            }
+        return entry
+
+    def record_request(self, model: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                       cached_tokens: int = 0, error: Optional[str] = None) -> None:
+        """记录一次请求；error 为失败原因，成功时为 None"""
+        with self._lock:
+            entry = self._model(model)
+            entry["requests"] += 1
+            entry["errors"] += error is not None
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cached_tokens"] += cached_tokens
+            entry["latency_sum"] += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    entry["latency_buckets"][i] += 1
+            self.latencies.append(latency)
+
+    def record_retry(self, reason: str) -> None:
+        """记录一次重试及触发重试的原因"""
+        with self._lock:
+            self.retries[reason] += 1
+
+    def record_fallback(self, path: str) -> None:
+        """记录一次回退路径的使用，如结构化输出回退到JSON"""
+        with self._lock:
+            self.fallbacks[path] += 1
+
+    def record_failure(self, reason: str, rows: int) -> None:
+        """记录一批数据的失败原因"""
+        with self._lock:
+            self.failures[reason] += rows
+
+    def update_progress(self, done_rows: int, total_rows: int) -> None:
+        """更新已完成行数和总行数"""
+        with self._lock:
+            self.done_rows = done_rows
+            self.total_rows = total_rows
+
+    def finish(self) -> None:
+        """标记任务结束，之后的吞吐按结束时间计算"""
+        with self._lock:
+            if self.finished_at is None:
+                self.finished_at = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前指标的快照：吞吐、剩余时间、费用、分位数耗时及各项计数"""
+        with self._lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            models = {model: {**entry, "latency_buckets": list(entry["latency_buckets"])} for model, entry in self.models.items()}
+            latencies = list(self.latencies)
+            done_rows, total_rows = self.done_rows, self.total_rows
+            retries, fallbacks, failures = dict(self.retries), dict(self.fallbacks), dict(self.failures)
+
+        rows_per_second = done_rows / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, total_rows - done_rows)
+        costs = {
+            model: estimate_cost(model, entry["prompt_tokens"], entry["completion_tokens"], entry["cached_tokens"])
+            for model, entry in models.items()
+        }
+        for model, cost in costs.items():
+            models[model]["cost"] = cost
+        return {
+            "elapsed_seconds": elapsed,
+            "done_rows": done_rows,
+            "total_rows": total_rows,
+            "rows_per_second": rows_per_second,
+            "eta_seconds": remaining / rows_per_second if rows_per_second > 0 else None,
+            # 不在价格表中的模型不计入费用
+            "cost": sum(cost for cost in costs.values() if cost is not None),
+            "cost_complete": all(cost is not None for cost in costs.values()),
+            "requests": sum(entry["requests"] for entry in models.values()),
+            "errors": sum(entry["errors"] for entry in models.values()),
+            "prompt_tokens": sum(entry["prompt_tokens"] for entry in models.values()),
+            "completion_tokens": sum(entry["completion_tokens"] for entry in models.values()),
+            "cached_tokens": sum(entry["cached_tokens"] for entry in models.values()),
+            "latency_p50": _percentile(latencies, 0.5),
+            "latency_p99": _percentile(latencies, 0.99),
+            "retries": retries,
+            "fallbacks": fallbacks,
+            "failures": failures,
+            "models": models,
+        }
+
+    def to_json(self) -> str:
+        """导出为JSON文本"""
+        return json.dumps({"latency_buckets": LATENCY_BUCKETS, **self.snapshot()}, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix: str = "annotation") -> str:
+        """导出为Prometheus文本格式，可写入node_exporter的textfile目录或由推送网关采集"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text else f"{prefix}_{name} {value}")
+
+        models = snapshot["models"]
+        metric("rows_done", "gauge", "Rows annotated so far.", [({}, snapshot["done_rows"])])
+        metric("rows_total", "gauge", "Rows to annotate.", [({}, snapshot["total_rows"])])
+        metric("rows_per_second", "gauge", "Annotation throughput.", [({}, round(snapshot["rows_per_second"], 3))])
+        metric("cost_usd", "gauge", "Estimated spend in USD for models with known pricing.", [({}, round(snapshot["cost"], 6))])
+        metric("requests_total", "counter", "API requests including retries.", [
+            ({"model": model, "status": status}, count)
+            for model, entry in models.items()
+            for status, count in (("ok", entry["requests"] - entry["errors"]), ("error", entry["errors"]))
+        ])
+        metric("tokens_total", "counter", "Tokens reported by the API.", [
+            ({"model": model, "kind": kind}, entry[f"{kind}_tokens"])
+            for model, entry in models.items()
+            for kind in ("prompt", "completion", "cached")
+        ])
+
+        lines.append(f"# HELP {prefix}_request_latency_seconds API request latency.")
+        lines.append(f"# TYPE {prefix}_request_latency_seconds histogram")
+        for model, entry in models.items():
+            label = _label(model)
+            for bound, count in zip(LATENCY_BUCKETS, entry["latency_buckets"]):
+                lines.append(f'{prefix}_request_latency_seconds_bucket{{model="{label}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_request_latency_seconds_bucket{{model="{label}",le="+Inf"}} {entry["requests"]}')
+            lines.append(f'{prefix}_request_latency_seconds_sum{{model="{label}"}} {entry["latency_sum"]:.6f}')
+            lines.append(f'{prefix}_request_latency_seconds_count{{model="{label}"}} {entry["requests"]}')
+
+        metric("retries_total", "counter", "Retried requests by reason.",
+               [({"reason": reason}, count) for reason, count in snapshot["retries"].items()])
+        metric("fallbacks_total", "counter", "Fallback path usage.",
+               [({"path": path}, count) for path, count in snapshot["fallbacks"].items()])
+        metric("failed_rows_total", "counter", "Rows in failed requests by reason.",
+               [({"reason": reason}, count) for reason, count in snapshot["failures"].items()])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from client_registry import api_key_fingerprint
+
+# 默认保存位置：docker-compose 中挂载的 ./data 目录
+DEFAULT_CATALOG_PATH = os.path.join(os.getenv("DATA_DIR", "data"), "model_catalog.json")
+
+
+class ModelCatalog:
+    """可用模型列表缓存
+
+    按 (base_url, API密钥哈希) 保存测试连接时获取的聊天模型列表，
+    有效期内直接返回，多个用户共用同一代理时不必反复请求模型列表。
+    """
+
+    def __init__(self, path: str = DEFAULT_CATALOG_PATH, ttl_seconds: float = 3600):
+        """初始化缓存并读取已保存的记录"""
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._entries = {}
+
+    @staticmethod
+    def _key(api_key: str, base_url: Optional[str]) -> str:
+        return f"{(base_url or '').rstrip('/')}|{api_key_fingerprint(api_key)}"
+
+    def get(self, api_key: str, base_url: Optional[str] = None) -> Optional[List[str]]:
+        """查询模型列表，不存在或已过期时返回 None"""
+        with self._lock:
+            entry = self._entries.get(self._key(api_key, base_url))
+        if not entry or time.time() - entry.get("updated_at", 0) > self.ttl_seconds:
+            return None
+        return list(entry["models"])
+
+    def set(self, api_key: str, base_url: Optional[str], models: List[str]) -> None:
+        """保存模型列表"""
+        with self._lock:
+            self._entries[self._key(api_key, base_url)] = {"models": list(models), "updated_at": time.time()}
+            self._save()
+
+    def invalidate(self, api_key: str, base_url: Optional[str] = None) -> None:
+        """删除记录，下次测试连接时重新获取"""
+        with self._lock:
+            if self._entries.pop(self._key(api_key, base_url), None) is not None:
+                self._save()
+
+    def _save(self) -> None:
+        """原子写入文件（调用方需持有锁）"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
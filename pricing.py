@@ -0,0 +1,49 @@
+from typing import Optional, Tuple
+
+# 常见模型的价格（美元 / 百万token）：(输入, 命中缓存的输入, 输出)
+# 按模型名前缀匹配，取最长的匹配项；价格以各服务商公开价格为准，可按需修改
+MODEL_PRICING = {
+    "gpt-3.5-turbo": (0.5, 0.5, 1.5),
+    "gpt-35-turbo": (0.5, 0.5, 1.5),
+    "gpt-4": (30.0, 30.0, 60.0),
+    "gpt-4-turbo": (10.0, 10.0, 30.0),
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+    "gpt-4.1": (2.0, 0.5, 8.0),
+    "gpt-4.1-mini": (0.4, 0.1, 1.6),
+    "gpt-4.1-nano": (0.1, 0.025, 0.4),
+    "o1": (15.0, 7.5, 60.0),
+    "o3": (2.0, 0.5, 8.0),
+    "o3-mini": (1.1, 0.55, 4.4),
+    "o4-mini": (1.1, 0.275, 4.4),
+    "gemini-1.5-flash": (0.075, 0.01875, 0.3),
+    "gemini-1.5-pro": (1.25, 0.3125, 5.0),
+    "gemini-2.0-flash": (0.1, 0.025, 0.4),
+    "gemini-2.5-flash": (0.3, 0.075, 2.5),
+    "gemini-2.5-pro": (1.25, 0.31, 10.0),
+    "deepseek-chat": (0.27, 0.07, 1.1),
+    "deepseek-reasoner": (0.55, 0.14, 2.19),
+}
+
+
+def get_model_pricing(model: str) -> Optional[Tuple[float, float, float]]:
+    """获取模型价格，未知模型返回 None"""
+    model = (model or "").lower()
+    matches = [prefix for prefix in MODEL_PRICING if model.startswith(prefix)]
+    if not matches:
+        return None
+    return MODEL_PRICING[max(matches, key=len)]
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Optional[float]:
+    """按token用量计算费用（美元），未知模型返回 None"""
+    pricing = get_model_pricing(model)
+    if pricing is None:
+        return None
+    input_price, cached_price, output_price = pricing
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    return (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1_000_000
@@ -0,0 +1,200 @@
+import json
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from token_estimator import estimate_tokens
+
+# 提示词格式
+PROMPT_FORMAT_JSON = "json"
+PROMPT_FORMAT_COMPACT = "compact"
+PROMPT_FORMAT_LOGPROB = "logprob"
+
+PROMPT_FORMATS = {
+    PROMPT_FORMAT_JSON: "JSON格式（返回选项文字）",
+    PROMPT_FORMAT_COMPACT: "紧凑格式（编号输入，返回选项编号）",
+    PROMPT_FORMAT_LOGPROB: "单字母分类（逐条请求，输出置信度）",
+}
+
+# 单字母分类用的选项代号，每个字母在常见分词器中都是单个token；
+# 接口的 top_logprobs 最多返回20个候选，选项数不能超过代号数
+LOGPROB_OPTION_CODES = "ABCDEFGHIJKLMNOPQRST"
+
+# 输出方式：结构化输出、JSON文本、紧凑编号
+OUTPUT_STRUCTURED = "structured"
+OUTPUT_JSON = "json"
+OUTPUT_COMPACT = "compact"
+OUTPUT_LOGPROB = "logprob"
+
+SYSTEM_ROLE = "你是一个专业的数据标注助手，请严格按照要求进行标注。"
+
+# 选项编号之间允许的分隔符（模型偶尔会使用中文逗号、顿号或换行）
+_CODE_SEPARATORS = re.compile(r"[,，、;；\s]+")
+
+
+def to_single_line(text: str) -> str:
+    """将文本压成一行，保证每条数据在紧凑格式中只占一行"""
+    return " ".join(text.split()) if ("\n" in text or "\r" in text) else text
+
+
+def format_numbered_rows(data: List[str]) -> str:
+    """按 "行号. 内容" 逐行排列数据"""
+    return "\n".join(f"{i}. {to_single_line(text)}" for i, text in enumerate(data, 1))
+
+
+def format_numbered_options(annotation_options: List[str]) -> str:
+    """按 "编号=选项" 逐行排列标注选项"""
+    return "\n".join(f"{i}={option}" for i, option in enumerate(annotation_options, 1))
+
+
+def format_lettered_options(annotation_options: List[str]) -> str:
+    """按 "字母=选项" 逐行排列标注选项"""
+    return "\n".join(f"{code}={option}" for code, option in zip(LOGPROB_OPTION_CODES, annotation_options))
+
+
+def build_instructions(annotation_requirements: str, annotation_options: List[str], output_mode: str) -> str:
+    """构建系统消息：角色、标注要求、选项和输出格式说明
+
+    只依赖任务配置，不含任何批次数据，同一任务所有批次的系统消息逐字节相同，
+    作为稳定前缀命中服务端的提示词缓存（OpenAI、Gemini等按前缀匹配缓存）。
+    """
+    if output_mode == OUTPUT_LOGPROB:
+        return f"""{SYSTEM_ROLE}
+
+标注要求：{annotation_requirements}
+
+可选标注选项（字母=选项）：
+{format_lettered_options(annotation_options)}
+
+用户会提供一条数据，请选择最合适的选项，如果数据不符合任何选项，请选择最接近的选项。
+只回答选项对应的一个大写字母，不要输出其他任何内容。"""
+
+    if output_mode == OUTPUT_COMPACT:
+        example = ",".join(str(i % len(annotation_options) + 1) for i in range(3))
+        return f"""{SYSTEM_ROLE}
+
+标注要求：{annotation_requirements}
+
+可选标注选项（编号=选项）：
+{format_numbered_options(annotation_options)}
+
+用户会提供若干行数据，每行一条，格式为 行号. 内容。
+请为每行数据选择最合适的选项编号，如果数据不符合任何选项，请选择最接近的选项。
+只返回选项编号，按数据顺序用英文逗号分隔，编号数量与数据行数一致，例如：{example}
+不要返回行号、选项文字或其他说明。"""
+
+    instructions = f"""{SYSTEM_ROLE}
+
+标注要求：{annotation_requirements}
+
+可选标注选项：{', '.join(annotation_options)}
+
+请对用户提供的数据进行标注，为每个数据项选择最合适的标注选项。
+如果数据不符合任何选项，请选择最接近的选项或标注为"其他"。
+"""
+    if output_mode == OUTPUT_JSON:
+        return instructions + """
+请直接返回JSON格式结果，不要使用代码块包裹：
+{"annotations": ["标注1", "标注2", "标注3", ...]}
+
+重要要求：
+1. 只返回纯JSON，不要添加```或其他格式
+2. 返回的标注数量必须与输入数据数量完全一致
+3. 每个标注都必须是提供的选项之一"""
+    return instructions + """
+重要要求：
+1. 返回的标注数量必须与输入数据数量完全一致
+2. 每个标注都必须是提供的选项之一"""
+
+
+def build_data_message(data: List[str], output_mode: str) -> str:
+    """构建用户消息：只包含本批数据，放在稳定前缀之后"""
+    if output_mode == OUTPUT_LOGPROB:
+        return f"数据：{data[0]}"
+    if output_mode == OUTPUT_COMPACT:
+        return f"数据（共 {len(data)} 行）：\n{format_numbered_rows(data)}"
+    return f"数据（共 {len(data)} 条）：\n{json.dumps(data, ensure_ascii=False, indent=2)}"
+
+
+def build_messages(data: List[str], annotation_requirements: str, annotation_options: List[str],
+                   output_mode: str) -> List[Dict[str, str]]:
+    """构建一批数据的请求消息：稳定的系统消息在前，批次数据在后"""
+    return [
+        {"role": "system", "content": build_instructions(annotation_requirements, annotation_options, output_mode)},
+        {"role": "user", "content": build_data_message(data, output_mode)},
+    ]
+
+
+def parse_compact_response(text: str, count: int, annotation_options: List[str]) -> Optional[List[str]]:
+    """将逗号分隔的选项编号映射回选项文字，数量不符或编号无效时返回 None
+
+    模型直接返回选项文字时也按原文接受。
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = "\n".join(line for line in text.split("\n") if not line.startswith("```"))
+
+    labels = []
+    for code in _CODE_SEPARATORS.split(text):
+        if not code:
+            continue
+        if code.isdigit() and 1 <= int(code) <= len(annotation_options):
+            labels.append(annotation_options[int(code) - 1])
+        elif code in annotation_options:
+            labels.append(code)
+        else:
+            return None
+    return labels if len(labels) == count else None
+
+
+def pick_option_by_logprobs(top_logprobs: Iterable[Tuple[str, float]],
+                            annotation_options: List[str]) -> Optional[Tuple[str, float]]:
+    """根据首个输出token的候选及对数概率选出概率最大的选项
+
+    同一字母的不同写法（如 "A" 和 " A"）概率相加，置信度为该选项在全部选项概率中的占比。
+    候选中没有任何选项代号时返回 None。
+    """
+    codes = {code: i for i, code in enumerate(LOGPROB_OPTION_CODES[:len(annotation_options)])}
+    probabilities = [0.0] * len(annotation_options)
+    for token, logprob in top_logprobs:
+        index = codes.get(token.strip().upper())
+        if index is not None:
+            probabilities[index] += math.exp(logprob)
+
+    total = sum(probabilities)
+    if total <= 0:
+        return None
+    best = max(range(len(probabilities)), key=probabilities.__getitem__)
+    return annotation_options[best], probabilities[best] / total
+
+
+def estimate_prompt_tokens(data: List[str], annotation_options: List[str], prompt_format: str) -> Dict[str, int]:
+    """估算一批数据在提示词中的输入token数和对应输出的token数（不含固定说明文字）"""
+    if prompt_format == PROMPT_FORMAT_COMPACT:
+        input_text = format_numbered_rows(data)
+        output_text = ",".join(str(len(annotation_options)) for _ in data)
+    else:
+        longest = max(annotation_options, key=len, default="")
+        input_text = json.dumps(data, ensure_ascii=False, indent=2)
+        output_text = json.dumps({"annotations": [longest] * len(data)}, ensure_ascii=False)
+    return {"input": estimate_tokens(input_text), "output": estimate_tokens(output_text)}
+
+
+def estimate_token_savings(data: List[str], annotation_options: List[str]) -> Dict[str, float]:
+    """比较JSON格式和紧凑格式的每行token数
+
+    返回每行的输入、输出token数（json_input / json_output / compact_input / compact_output）
+    以及紧凑格式节省的比例 saving_ratio。
+    """
+    rows = max(1, len(data))
+    json_tokens = estimate_prompt_tokens(data, annotation_options, PROMPT_FORMAT_JSON)
+    compact_tokens = estimate_prompt_tokens(data, annotation_options, PROMPT_FORMAT_COMPACT)
+    json_total = json_tokens["input"] + json_tokens["output"]
+    compact_total = compact_tokens["input"] + compact_tokens["output"]
+    return {
+        "json_input": json_tokens["input"] / rows,
+        "json_output": json_tokens["output"] / rows,
+        "compact_input": compact_tokens["input"] / rows,
+        "compact_output": compact_tokens["output"] / rows,
+        "saving_ratio": 1 - compact_total / json_total if json_total else 0.0,
+    }
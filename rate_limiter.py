@@ -0,0 +1,182 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import openai
+from tenacity import Retrying, retry_if_exception, stop_after_attempt
+
+
+class TokenBucket:
+    """令牌桶，按每分钟额度匀速补充"""
+
+    def __init__(self, rate_per_minute: float):
+        """初始化令牌桶，容量为一分钟的额度"""
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.refill_per_second = rate_per_minute / 60.0
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> None:
+        """取出指定数量的令牌，不足时阻塞等待"""
+        # 单次请求超过桶容量时按容量计，避免永远等不到
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait_seconds = (amount - self.tokens) / self.refill_per_second
+            time.sleep(min(wait_seconds, 1.0))
+
+
+class AdaptiveConcurrency:
+    """自适应并发控制
+
+    遇到限流时并发上限减半，连续成功一定次数后逐个恢复，不超过初始上限。
+    """
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1, increase_after: int = 10):
+        """初始化并发控制"""
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = self.max_concurrency
+        self.increase_after = increase_after
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """占用一个并发名额"""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        """释放一个并发名额"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        """记录一次成功请求，持续成功时提高并发上限"""
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.increase_after and self.limit < self.max_concurrency:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def on_rate_limited(self) -> None:
+        """记录一次限流，降低并发上限"""
+        with self._condition:
+            self.limit = max(self.min_concurrency, self.limit // 2)
+            self._successes = 0
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """限流、服务端错误、超时和连接错误可以重试"""
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    """解析响应头中的 Retry-After，支持秒数、毫秒和HTTP日期格式"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """API请求限流与重试
+
+    请求前按每分钟请求数（RPM）和每分钟token数（TPM）限流，
+    遇到429/5xx时按 Retry-After 或带抖动的指数退避重试，并自适应调整并发。
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0,
+                 max_concurrency: int = 4, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0):
+        """初始化限流器，额度为0表示不限制"""
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+        self.rate_limited = 0
+        self._stats_lock = threading.Lock()
+
+    def _wait(self, retry_state) -> float:
+        """计算重试等待时间：优先使用 Retry-After，否则指数退避加随机抖动"""
+        error = retry_state.outcome.exception()
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max) + random.uniform(0, self.backoff_base)
+        backoff = min(self.backoff_max, self.backoff_base * (2 ** (retry_state.attempt_number - 1)))
+        return random.uniform(0, backoff)
+
+    def _before_sleep(self, retry_state) -> None:
+        with self._stats_lock:
+            self.retries += 1
+
+    def call(self, fn: Callable, *args, estimated_tokens: int = 0, **kwargs):
+        """在限流和重试保护下调用 fn"""
+        retrying = Retrying(
+            retry=retry_if_exception(_is_retryable),
+            stop=stop_after_attempt(self.max_retries + 1),
+            wait=self._wait,
+            before_sleep=self._before_sleep,
+            reraise=True
+        )
+        return retrying(self._attempt, fn, args, kwargs, estimated_tokens)
+
+    def _attempt(self, fn: Callable, args, kwargs, estimated_tokens: int):
+        """执行一次请求"""
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.token_bucket and estimated_tokens:
+            self.token_bucket.acquire(estimated_tokens)
+
+        self.concurrency.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except openai.RateLimitError:
+            with self._stats_lock:
+                self.rate_limited += 1
+            self.concurrency.on_rate_limited()
+            raise
+        finally:
+            self.concurrency.release()
+
+        self.concurrency.on_success()
+        return result
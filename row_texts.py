@@ -0,0 +1,54 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# 拼接多列文本时使用的分隔符
+ROW_TEXT_SEPARATOR = " | "
+
+
+def build_row_texts(df: pd.DataFrame, columns: List[str]) -> List[str]:
+    """将每行选中列的值拼接为待标注文本，列之间用 " | " 分隔
+
+    按列做向量化的字符串转换和拼接，结果与逐行 str(row[col]) 拼接完全一致：
+    缺失值为 "nan"，整张表都是数值列时按公共类型显示（如整数显示为 "1.0"）。
+    """
+    if not columns:
+        return [""] * len(df)
+
+    # 逐行取值时每行会被转换为整张表的公共类型，这里保持相同的转换
+    if all(isinstance(dtype, np.dtype) for dtype in df.dtypes):
+        common_dtype = df.iloc[:0].to_numpy().dtype
+    elif all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        # 可空数值类型的公共类型取决于是否含缺失值，纯数值表转换代价很小
+        common_dtype = df.to_numpy().dtype
+    else:
+        common_dtype = np.dtype(object)
+
+    texts = None
+    for col in columns:
+        series = df[col]
+        if common_dtype != object:
+            series = series.astype(common_dtype)
+        column_text = series.astype(object).astype(str)
+        texts = column_text if texts is None else texts.str.cat(column_text, sep=ROW_TEXT_SEPARATOR)
+    return texts.tolist()
+
+
+def deduplicate_rows(data: List[str]) -> tuple[List[str], List[int]]:
+    """合并重复文本
+
+    返回 (按首次出现顺序排列的唯一文本, 每行对应的唯一文本下标)，
+    标注完成后用下标将结果展开回所有行。
+    """
+    index_of: Dict[str, int] = {}
+    unique_data: List[str] = []
+    row_to_unique: List[int] = []
+    for text in data:
+        index = index_of.get(text)
+        if index is None:
+            index = len(unique_data)
+            index_of[text] = index
+            unique_data.append(text)
+        row_to_unique.append(index)
+    return unique_data, row_to_unique
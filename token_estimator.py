@@ -0,0 +1,12 @@
+import math
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数
+
+    不依赖具体模型的分词器：中文等多字节字符约1个token，
+    英文和数字约3-4个字符1个token，按UTF-8字节数/3估算，偏保守。
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text.encode("utf-8")) / 3)